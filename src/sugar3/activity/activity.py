@@ -298,6 +298,7 @@ class Activity(Window, Gtk.Container):
         self.shared_activity = None
         self._join_id = None
         self._updating_jobject = False
+        self._copy_requested = False
         self._closing = False
         self._quit_requested = False
         self._deleting = False
@@ -389,10 +390,11 @@ class Activity(Window, Gtk.Container):
         jobject.metadata['launch-times'] = str(int(time.time()))
         jobject.file_path = ''
 
-        # FIXME: We should be able to get an ID synchronously from the DS,
-        # then call async the actual create.
-        # http://bugs.sugarlabs.org/ticket/2169
-        datastore.write(jobject)
+        # The writes done before the entry is created are queued by the
+        # datastore module
+        datastore.write(jobject,
+                reply_handler=self.__jobject_create_cb,
+                error_handler=self.__jobject_error_cb)
 
         return jobject
 
@@ -539,8 +541,8 @@ class Activity(Window, Gtk.Container):
             self._read_file_called = True
         canvas.disconnect_by_func(self.__canvas_map_cb)
 
-    def __jobject_create_cb(self):
-        pass
+    def __jobject_create_cb(self, object_id):
+        logging.debug('Activity datastore object created: %s', object_id)
 
     def __jobject_error_cb(self, err):
         logging.debug('Error creating activity datastore object: %s', err)
@@ -605,9 +607,13 @@ class Activity(Window, Gtk.Container):
         """
         raise NotImplementedError
 
-    def __save_cb(self):
+    def __save_cb(self, object_id=None):
         logging.debug('Activity.__save_cb')
         self._updating_jobject = False
+        # The file was moved to the datastore, the journal object has none
+        # anymore so that metadata writes don't send it again
+        self._owns_file = False
+        self._complete_copy()
         if self._quit_requested:
             self._session.will_quit(self, True)
         elif self._closing:
@@ -616,6 +622,7 @@ class Activity(Window, Gtk.Container):
     def __save_error_cb(self, err):
         logging.debug('Activity.__save_error_cb')
         self._updating_jobject = False
+        self._complete_copy()
         if self._quit_requested:
             self._session.will_quit(self, False)
         if self._closing:
@@ -721,17 +728,18 @@ class Activity(Window, Gtk.Container):
             logging.info('Activity.save: still processing a previous request.')
             return
 
-        buddies_dict = self._get_buddies()
-        if buddies_dict:
-            self.metadata['buddies_id'] = json.dumps(buddies_dict.keys())
-            self.metadata['buddies'] = json.dumps(self._get_buddies())
+        with self.metadata.batch_update():
+            buddies_dict = self._get_buddies()
+            if buddies_dict:
+                self.metadata['buddies_id'] = json.dumps(buddies_dict.keys())
+                self.metadata['buddies'] = json.dumps(self._get_buddies())
 
-        preview = self.get_preview()
-        if preview is not None:
-            self.metadata['preview'] = dbus.ByteArray(preview)
+            preview = self.get_preview()
+            if preview is not None:
+                self.metadata['preview'] = dbus.ByteArray(preview)
 
-        if not self.metadata.get('activity_id', ''):
-            self.metadata['activity_id'] = self.get_id()
+            if not self.metadata.get('activity_id', ''):
+                self.metadata['activity_id'] = self.get_id()
 
         file_path = os.path.join(self.get_activity_root(), 'instance',
                                  '%i' % time.time())
@@ -744,16 +752,24 @@ class Activity(Window, Gtk.Container):
                 self._owns_file = True
                 self._jobject.file_path = file_path
 
-        # Cannot call datastore.write async for creates:
-        # https://dev.laptop.org/ticket/3071
-        if self._jobject.object_id is None:
-            datastore.write(self._jobject, transfer_ownership=True)
-        else:
-            self._updating_jobject = True
-            datastore.write(self._jobject,
-                    transfer_ownership=True,
-                    reply_handler=self.__save_cb,
-                    error_handler=self.__save_error_cb)
+        self._updating_jobject = True
+        datastore.write(self._jobject,
+                transfer_ownership=True,
+                reply_handler=self.__save_cb,
+                error_handler=self.__save_error_cb)
+
+    def save_metadata(self):
+        """Request that the metadata of the activity is saved to the Journal.
+
+        Unlike save() the activity data is not written. The requests made in
+        a row, when several fields are edited for example, result in a single
+        write of the journal object.
+        """
+        if self._jobject is None:
+            logging.debug('Cannot save metadata, no journal object.')
+            return
+
+        datastore.schedule_write(self._jobject)
 
     def copy(self):
         """Request that the activity 'Keep in Journal' the current state
@@ -764,7 +780,18 @@ class Activity(Window, Gtk.Container):
         """
         logging.debug('Activity.copy: %r', self._jobject.object_id)
         self.save()
-        self._jobject.object_id = None
+        if self._updating_jobject:
+            # The save can be queued until the journal object is created,
+            # and its entry is only known then, so detach it once written
+            self._copy_requested = True
+        else:
+            self._jobject.object_id = None
+
+    def _complete_copy(self):
+        if self._copy_requested:
+            self._copy_requested = False
+            # The next save creates a new entry
+            self._jobject.object_id = None
 
     def __privacy_changed_cb(self, shared_activity, param_spec):
         logging.debug('__privacy_changed_cb %r', shared_activity.props.private)
@@ -22,10 +22,19 @@ STABLE.
 import operator
 import os
 import sys
+import stat
+import time
+import json
+import zlib
+import struct
+import hashlib
+import itertools
+import multiprocessing
 import zipfile
 import tarfile
 import shutil
 import subprocess
+import tempfile
 import re
 import gettext
 from optparse import OptionParser
@@ -39,6 +48,14 @@ from sugar3.bundle.activitybundle import ActivityBundle
 IGNORE_DIRS = ['dist', '.git']
 IGNORE_FILES = ['.gitignore', 'MANIFEST', '*.pyc', '*~', '*.bak', 'pseudo.po']
 
+# Date of the members of the xo bundles, unless SOURCE_DATE_EPOCH is set,
+# so that building the same files gives the same bundle
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Fields of the local file headers of zip files
+_FH_FILENAME_LENGTH = 10
+_FH_EXTRA_FIELD_LENGTH = 11
+
 
 def list_files(base_dir, ignore_dirs=None, ignore_files=None):
     result = []
@@ -62,6 +79,65 @@ def list_files(base_dir, ignore_dirs=None, ignore_files=None):
     return result
 
 
+def _is_up_to_date(path, sources):
+    if not os.path.exists(path):
+        return False
+    mtime = os.stat(path).st_mtime
+    for source in sources:
+        if os.stat(source).st_mtime > mtime:
+            return False
+    return True
+
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _compress_file(path):
+    """Deflate a file as zipfile does.
+
+    Return: CRC, size, SHA-1 and compressed data of the file
+
+    """
+    crc = 0
+    size = 0
+    digest = hashlib.sha1()
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                  -15)
+    data = []
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), ''):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            digest.update(chunk)
+            data.append(compressor.compress(chunk))
+    data.append(compressor.flush())
+    return crc & 0xffffffff, size, digest.hexdigest(), ''.join(data)
+
+
+def _read_compressed(zip_file, info):
+    zip_file.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader,
+                           zip_file.fp.read(zipfile.sizeFileHeader))
+    zip_file.fp.seek(header[_FH_FILENAME_LENGTH] +
+                     header[_FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+    return zip_file.fp.read(info.compress_size)
+
+
+def _write_compressed(zip_file, info, data):
+    # zipfile has no API to add data compressed already
+    info.header_offset = zip_file.fp.tell()
+    zip_file.fp.write(info.FileHeader())
+    zip_file.fp.write(data)
+    zip_file.filelist.append(info)
+    zip_file.NameToInfo[info.filename] = info
+    zip_file._didModify = True
+
+
 class Config(object):
 
     def __init__(self, source_dir=None, dist_dir=None, dist_name=None):
@@ -114,16 +190,17 @@ class Builder(object):
             return
 
         locale_dir = os.path.join(self.config.source_dir, 'locale')
+        info_path = os.path.join(self.config.source_dir, 'activity',
+                                 'activity.info')
 
-        if os.path.exists(locale_dir):
-            shutil.rmtree(locale_dir)
-
+        langs = []
         for f in os.listdir(po_dir):
             if not f.endswith('.po') or f == 'pseudo.po':
                 continue
 
             file_name = os.path.join(po_dir, f)
             lang = f[:-3]
+            langs.append(lang)
 
             localedir = os.path.join(self.config.source_dir, 'locale', lang)
             mo_path = os.path.join(localedir, 'LC_MESSAGES')
@@ -131,6 +208,12 @@ class Builder(object):
                 os.makedirs(mo_path)
 
             mo_file = os.path.join(mo_path, '%s.mo' % self.config.bundle_id)
+            linfo_file = os.path.join(localedir, 'activity.linfo')
+            # The name and summary translated come from activity.info too
+            if _is_up_to_date(mo_file, [file_name]) and \
+                    _is_up_to_date(linfo_file, [mo_file, info_path]):
+                continue
+
             args = ['msgfmt', '--output-file=%s' % mo_file, file_name]
             retcode = subprocess.call(args)
             if retcode:
@@ -139,12 +222,17 @@ class Builder(object):
             cat = gettext.GNUTranslations(open(mo_file, 'r'))
             translated_name = cat.gettext(self.config.activity_name)
             translated_summary = cat.gettext(self.config.summary)
-            linfo_file = os.path.join(localedir, 'activity.linfo')
             f = open(linfo_file, 'w')
             f.write('[Activity]\nname = %s\n' % translated_name)
             f.write('summary = %s\n' % translated_summary)
             f.close()
 
+        # The languages whose po file was removed
+        if os.path.isdir(locale_dir):
+            for lang in os.listdir(locale_dir):
+                if lang not in langs:
+                    shutil.rmtree(os.path.join(locale_dir, lang))
+
     def get_files(self):
         allfiles = list_files(self.config.source_dir,
                               IGNORE_DIRS, IGNORE_FILES)
@@ -184,30 +272,155 @@ class Packager(object):
 
 
 class XOPackager(Packager):
+    """Package the activity as a xo bundle.
 
-    def __init__(self, builder):
+    The members are sorted, dated from SOURCE_DATE_EPOCH or 1980 and get
+    normalized permissions, so that the same files always give the same
+    bundle. The compressed members of the previous bundle are reused for
+    the files which did not change, recognized by their size and mtime,
+    or their SHA-1 if only the mtime changed, as recorded in a cache file
+    next to the bundle. The other files are compressed by a pool of
+    processes.
+
+    Keyword arguments:
+    builder -- the Builder of the activity
+    processes -- number of processes compressing files, the number of
+                 CPUs if None (default None)
+
+    """
+
+    def __init__(self, builder, processes=None):
         Packager.__init__(self, builder.config)
 
         self.builder = builder
         self.builder.build_locale()
         self.package_path = os.path.join(self.config.dist_dir,
                                          self.config.xo_name)
+        self._cache_path = os.path.join(self.config.dist_dir,
+                                        '.%s.cache' % self.config.xo_name)
+        self._processes = processes
 
-    def package(self):
-        bundle_zip = zipfile.ZipFile(self.package_path, 'w',
-                                     zipfile.ZIP_DEFLATED)
-
+    def _get_members(self):
+        members = {}
         for f in self.get_files_in_git():
-            bundle_zip.write(os.path.join(self.config.source_dir, f),
-                             os.path.join(self.config.bundle_root_dir, f))
+            members[os.path.join(self.config.bundle_root_dir, f)] = \
+                os.path.join(self.config.source_dir, f)
         locale_dir = os.path.join(self.config.source_dir, 'locale')
         locale_files = list_files(locale_dir, IGNORE_DIRS, IGNORE_FILES)
         for f in locale_files:
-            bundle_zip.write(os.path.join(locale_dir, f),
-                             os.path.join(self.config.bundle_root_dir,
-                                          'locale', f))
+            members[os.path.join(self.config.bundle_root_dir, 'locale',
+                                 f)] = os.path.join(locale_dir, f)
+        return sorted(members.items())
+
+    def _get_date_time(self):
+        epoch = os.environ.get('SOURCE_DATE_EPOCH')
+        if epoch is None:
+            return _ZIP_DATE_TIME
+        return max(time.gmtime(int(epoch))[:6], _ZIP_DATE_TIME)
+
+    def _load_previous(self):
+        """Return the previous bundle and the files it was built from."""
+        try:
+            with open(self._cache_path) as cache_file:
+                cache = json.load(cache_file)
+            package_stat = os.stat(self.package_path)
+            if cache['package'] != [package_stat.st_size,
+                                    package_stat.st_mtime]:
+                return None, {}
+            return zipfile.ZipFile(self.package_path), cache['files']
+        except (IOError, OSError, ValueError, KeyError, zipfile.error):
+            return None, {}
+
+    def _save_cache(self, files):
+        package_stat = os.stat(self.package_path)
+        cache = {'package': [package_stat.st_size, package_stat.st_mtime],
+                 'files': files}
+        with open(self._cache_path, 'w') as cache_file:
+            json.dump(cache, cache_file, separators=(',', ':'))
+
+    def _get_reusable_info(self, previous, previous_files, name, path,
+                           file_stat):
+        if previous is None or name not in previous_files:
+            return None, None
+        size, mtime, digest = previous_files[name]
+        if size != file_stat.st_size:
+            return None, None
+        if mtime != file_stat.st_mtime:
+            if _hash_file(path) != digest:
+                return None, None
+        try:
+            info = previous.getinfo(name)
+        except KeyError:
+            return None, None
+        if info.compress_type != zipfile.ZIP_DEFLATED:
+            return None, None
+        return info, digest
+
+    def package(self):
+        members = self._get_members()
+        date_time = self._get_date_time()
+        previous, previous_files = self._load_previous()
+
+        files = {}
+        reused = {}
+        to_compress = []
+        for name, path in members:
+            file_stat = os.stat(path)
+            info, digest = self._get_reusable_info(previous, previous_files,
+                                                   name, path, file_stat)
+            if info is not None:
+                reused[name] = info
+            else:
+                to_compress.append(path)
+            files[name] = [file_stat.st_size, file_stat.st_mtime, digest]
 
-        bundle_zip.close()
+        pool = None
+        if len(to_compress) > 1 and self._processes != 1:
+            pool = multiprocessing.Pool(self._processes)
+            compressed = pool.imap(_compress_file, to_compress)
+        else:
+            compressed = itertools.imap(_compress_file, to_compress)
+
+        fd, temp_path = tempfile.mkstemp(dir=self.config.dist_dir,
+                                         prefix='.' + self.config.xo_name)
+        os.close(fd)
+        try:
+            bundle_zip = zipfile.ZipFile(temp_path, 'w',
+                                         zipfile.ZIP_DEFLATED)
+            for name, path in members:
+                info = zipfile.ZipInfo(name, date_time)
+                info.create_system = 3
+                info.compress_type = zipfile.ZIP_DEFLATED
+                mode = 0755 if os.stat(path).st_mode & 0111 else 0644
+                info.external_attr = (stat.S_IFREG | mode) << 16
+
+                if name in reused:
+                    previous_info = reused[name]
+                    info.CRC = previous_info.CRC
+                    info.file_size = previous_info.file_size
+                    data = _read_compressed(previous, previous_info)
+                else:
+                    info.CRC, info.file_size, files[name][2], data = \
+                        compressed.next()
+                info.compress_size = len(data)
+                _write_compressed(bundle_zip, info, data)
+            bundle_zip.close()
+        except:
+            # pylint: disable=W0702
+            os.remove(temp_path)
+            raise
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if previous is not None:
+                previous.close()
+
+        os.chmod(temp_path, 0644)
+        os.rename(temp_path, self.package_path)
+        self._save_cache(files)
+        logging.debug('Packaged %s, %d files compressed, %d reused',
+                      self.package_path, len(to_compress), len(reused))
 
 
 class SourcePackager(Packager):
@@ -288,11 +501,15 @@ def cmd_dev(config, args):
 def cmd_dist_xo(config, args):
     """Create a xo bundle package"""
 
-    if args:
-        print 'Usage: %prog dist_xo'
+    parser = OptionParser(usage='usage: %prog dist_xo [options]')
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=None,
+                      help='Number of processes compressing files')
+    (suboptions, subargs) = parser.parse_args(args)
+    if subargs:
+        parser.print_help()
         return
 
-    packager = XOPackager(Builder(config))
+    packager = XOPackager(Builder(config), suboptions.jobs)
     packager.package()
 
 
@@ -208,9 +208,10 @@ class TitleEntry(Gtk.ToolItem):
         if title == activity.metadata['title']:
             return
 
-        activity.metadata['title'] = title
-        activity.metadata['title_set_by_user'] = '1'
-        activity.save()
+        with activity.metadata.batch_update():
+            activity.metadata['title'] = title
+            activity.metadata['title_set_by_user'] = '1'
+        activity.save_metadata()
 
         activity.set_title(title)
 
@@ -278,7 +279,7 @@ class DescriptionItem(Gtk.ToolItem):
             return
 
         activity.metadata['description'] = description
-        activity.save()
+        activity.save_metadata()
         return False
 
 
@@ -48,7 +48,14 @@ class ActivityBundle(Bundle):
     _unzipped_extension = '.activity'
     _infodir = 'activity'
 
-    def __init__(self, path):
+    def __init__(self, path, index=None):
+        """Keyword arguments:
+        path -- path of the bundle
+        index -- an ActivityBundleIndex, to get the activity.info data from
+                 instead of parsing it, if the bundle did not change since
+                 it was indexed (default None)
+
+        """
         Bundle.__init__(self, path)
         self.activity_class = None
         self.bundle_exec = None
@@ -65,20 +72,72 @@ class ActivityBundle(Bundle):
         self._summary = None
         self._local_summary = None
 
-        info_file = self.get_file('activity/activity.info')
-        if info_file is None:
-            raise MalformedBundleException('No activity.info file')
-        self._parse_info(info_file)
+        lang = locale.getdefaultlocale()[0]
+
+        info = None
+        if index is not None:
+            info = index.get_info(self)
+
+        if info is None:
+            info_file = self.get_file('activity/activity.info')
+            if info_file is None:
+                raise MalformedBundleException('No activity.info file')
+            self._parse_info(info_file)
+            info = self._get_info()
+        else:
+            self._set_info(info)
+
+        local_info = None
+        if index is not None:
+            local_info = index.get_local_info(self, lang or '')
 
-        linfo_file = self._get_linfo_file()
-        if linfo_file:
-            self._parse_linfo(linfo_file)
+        if local_info is None:
+            linfo_file = self._get_linfo_file(lang)
+            if linfo_file:
+                self._parse_linfo(linfo_file)
 
-        if self._local_name == None:
-            self._local_name = self._name
+            if self._local_name == None:
+                self._local_name = self._name
 
-        if self._local_summary == None:
-            self._local_summary = self._summary
+            if self._local_summary == None:
+                self._local_summary = self._summary
+
+            if index is not None:
+                index.set_info(self, info, lang or '', self._get_local_info())
+        else:
+            self._set_local_info(local_info)
+
+    def _get_info(self):
+        return {'bundle_id': self._bundle_id,
+                'name': self._name,
+                'exec': self.bundle_exec,
+                'mime_types': self._mime_types,
+                'show_launcher': self._show_launcher,
+                'tags': self._tags,
+                'icon': self._icon,
+                'activity_version': self._activity_version,
+                'summary': self._summary}
+
+    def _set_info(self, info):
+        self._bundle_id = info['bundle_id']
+        self._name = info['name']
+        self.bundle_exec = info['exec']
+        self._mime_types = info['mime_types']
+        self._show_launcher = info['show_launcher']
+        self._tags = info['tags']
+        self._icon = info['icon']
+        self._activity_version = info['activity_version']
+        self._summary = info['summary']
+
+    def _get_local_info(self):
+        return {'name': self._local_name,
+                'summary': self._local_summary,
+                'tags': self._tags}
+
+    def _set_local_info(self, local_info):
+        self._local_name = local_info['name']
+        self._local_summary = local_info['summary']
+        self._tags = local_info['tags']
 
     def _parse_info(self, info_file):
         cp = ConfigParser()
@@ -134,8 +193,7 @@ class ActivityBundle(Bundle):
         if cp.has_option(section, 'summary'):
             self._summary = cp.get(section, 'summary')
 
-    def _get_linfo_file(self):
-        lang = locale.getdefaultlocale()[0]
+    def _get_linfo_file(self, lang):
         if not lang:
             return None
 
@@ -258,6 +316,10 @@ class ActivityBundle(Bundle):
     def install_mime_type(self, install_path):
         """ Update the mime type database and install the mime type icon
         """
+        # Not imported at the top, building bundles does not need gi
+        from sugar3.bundle.mimeindex import get_mime_type_index
+        mime_type_index = get_mime_type_index()
+
         xdg_data_home = os.getenv('XDG_DATA_HOME',
                                   os.path.expanduser('~/.local/share'))
 
@@ -272,6 +334,9 @@ class ActivityBundle(Bundle):
             self._symlink(mime_path, installed_mime_path)
             os.spawnlp(os.P_WAIT, 'update-mime-database',
                        'update-mime-database', mime_dir)
+            mime_type_index.clear_ancestors()
+
+        mime_type_index.set_bundle(self._bundle_id, self.get_mime_types())
 
         mime_types = self.get_mime_types()
         if mime_types is not None:
@@ -305,10 +370,14 @@ class ActivityBundle(Bundle):
         os.symlink(src, dst)
 
     def uninstall(self, install_path, force=False, delete_profile=False):
+        from sugar3.bundle.mimeindex import get_mime_type_index
+        mime_type_index = get_mime_type_index()
+
         if os.path.islink(install_path):
             # Don't remove the actual activity dir if it's a symbolic link
             # because we may be removing user data.
             os.unlink(install_path)
+            mime_type_index.remove_bundle(self._bundle_id)
             return
 
         xdg_data_home = os.getenv('XDG_DATA_HOME',
@@ -321,6 +390,7 @@ class ActivityBundle(Bundle):
             os.remove(installed_mime_path)
             os.spawnlp(os.P_WAIT, 'update-mime-database',
                        'update-mime-database', mime_dir)
+            mime_type_index.clear_ancestors()
 
         mime_types = self.get_mime_types()
         if mime_types is not None:
@@ -340,6 +410,9 @@ class ActivityBundle(Bundle):
                 shutil.rmtree(bundle_profile_path, ignore_errors=True)
 
         self._uninstall(install_path)
+        # Only once it is really gone, it still supports its MIME types
+        # if the uninstall failed
+        mime_type_index.remove_bundle(self._bundle_id)
 
     def is_user_activity(self):
         return self.get_path().startswith(env.get_user_activities_path())
@@ -21,11 +21,22 @@ UNSTABLE.
 """
 
 import os
+import stat
+import time
 import logging
 import shutil
+import tempfile
+import threading
+import Queue
 import StringIO
 import zipfile
 
+# Bytes of a zip member copied at once when extracting it
+_EXTRACT_CHUNK_SIZE = 64 * 1024
+
+# Threads extracting the members of a bundle
+_EXTRACT_THREADS = 4
+
 
 class AlreadyInstalledException(Exception):
     pass
@@ -51,6 +62,72 @@ class MalformedBundleException(Exception):
     pass
 
 
+class _ZipExtractor(object):
+    """Extract members of a zip file to a directory, on a few threads.
+
+    Each thread reads the zip file through its own ZipFile, copying the
+    members in chunks. The directories must exist already.
+    """
+
+    def __init__(self, zip_path, members, dest_dir):
+        self._zip_path = zip_path
+        self._dest_dir = dest_dir
+        self._queue = Queue.Queue()
+        for member in members:
+            self._queue.put(member)
+        self._error = None
+
+    def run(self, threads=_EXTRACT_THREADS):
+        workers = []
+        for i_ in range(min(threads, self._queue.qsize())):
+            worker = threading.Thread(target=self._extract_members)
+            worker.start()
+            workers.append(worker)
+
+        for worker in workers:
+            worker.join()
+
+        if self._error is not None:
+            raise ZipExtractException(self._error)
+
+    def _extract_members(self):
+        try:
+            zip_file = zipfile.ZipFile(self._zip_path)
+            try:
+                while self._error is None:
+                    try:
+                        info, path = self._queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    self._extract_member(zip_file, info, path)
+            finally:
+                zip_file.close()
+        except Exception, e:
+            logging.exception('Error extracting %s', self._zip_path)
+            self._error = e
+
+    def _extract_member(self, zip_file, info, path):
+        dest_path = os.path.join(self._dest_dir, path)
+        mode = info.external_attr >> 16
+
+        if stat.S_ISLNK(mode):
+            target = zip_file.read(info)
+            os.symlink(target, dest_path)
+            return
+
+        source = zip_file.open(info)
+        try:
+            with open(dest_path, 'wb') as dest:
+                shutil.copyfileobj(source, dest, _EXTRACT_CHUNK_SIZE)
+        finally:
+            source.close()
+
+        if mode & 0777:
+            os.chmod(dest_path, mode & 0777)
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        os.utime(dest_path, (mtime, mtime))
+
+
 class Bundle(object):
     """A Sugar activity, content module, etc.
 
@@ -69,6 +146,10 @@ class Bundle(object):
         self._path = path
         self._zip_root_dir = None
         self._zip_file = None
+        # Members and directories of the zip file, relative to its root
+        # directory, see _check_zip_bundle()
+        self._zip_members = {}
+        self._zip_dirs = set()
 
         if not os.path.isdir(self._path):
             try:
@@ -83,14 +164,14 @@ class Bundle(object):
             self._zip_file.close()
 
     def _check_zip_bundle(self):
-        file_names = self._zip_file.namelist()
-        if len(file_names) == 0:
+        infos = self._zip_file.infolist()
+        if len(infos) == 0:
             raise MalformedBundleException('Empty zip file')
 
-        if file_names[0] == 'mimetype':
-            del file_names[0]
+        if infos[0].filename == 'mimetype':
+            del infos[0]
 
-        self._zip_root_dir = file_names[0].split('/')[0]
+        self._zip_root_dir = infos[0].filename.split('/')[0]
         if self._zip_root_dir.startswith('.'):
             raise MalformedBundleException(
                 'root directory starts with .')
@@ -102,12 +183,31 @@ class Bundle(object):
                     'directory whose name ends with %r' %
                     self._unzipped_extension)
 
-        for file_name in file_names:
+        self._zip_dirs.add('')
+        for info in infos:
+            file_name = info.filename
             if not file_name.startswith(self._zip_root_dir):
                 raise MalformedBundleException(
                     'All files in the bundle must be inside a single ' +
                     'top-level directory')
 
+            path = file_name[len(self._zip_root_dir) + 1:]
+            if not path:
+                continue
+            if path.endswith('/'):
+                path = path.rstrip('/')
+            else:
+                self._zip_members[path] = info
+                path = os.path.dirname(path)
+
+            # Zip files don't need entries for the directories
+            while path not in self._zip_dirs:
+                self._zip_dirs.add(path)
+                path = os.path.dirname(path)
+
+    def _get_zip_member(self, filename):
+        return self._zip_members.get(os.path.normpath(filename))
+
     def get_file(self, filename):
         f = None
 
@@ -118,61 +218,174 @@ class Bundle(object):
             except IOError:
                 return None
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                data = self._zip_file.read(path)
-                f = StringIO.StringIO(data)
-            except KeyError:
+            info = self._get_zip_member(filename)
+            if info is None:
                 logging.debug('%s not found.', filename)
+            else:
+                f = StringIO.StringIO(self._zip_file.read(info))
 
         return f
 
+    def open_file(self, filename):
+        """Open a file of the bundle for reading.
+
+        Unlike get_file(), the file is read as it is used, even in a zip
+        bundle, and can't be seeked then.
+
+        Return: a file-like object, or None if there is no such file
+
+        """
+        if self._zip_file is None:
+            path = os.path.join(self._path, filename)
+            try:
+                return open(path, 'rb')
+            except IOError:
+                return None
+        else:
+            info = self._get_zip_member(filename)
+            if info is None:
+                logging.debug('%s not found.', filename)
+                return None
+            return self._zip_file.open(info)
+
     def is_file(self, filename):
         if self._zip_file is None:
             path = os.path.join(self._path, filename)
             return os.path.isfile(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename)
-            try:
-                self._zip_file.getinfo(path)
-            except KeyError:
-                return False
-
-            return True
+            return self._get_zip_member(filename) is not None
 
     def is_dir(self, filename):
         if self._zip_file is None:
             path = os.path.join(self._path, filename)
             return os.path.isdir(path)
         else:
-            path = os.path.join(self._zip_root_dir, filename, "")
-            for f in self._zip_file.namelist():
-                if f.startswith(path):
-                    return True
-            return False
+            path = os.path.normpath(filename)
+            if path == '.':
+                path = ''
+            return path in self._zip_dirs
 
     def get_path(self):
         """Get the bundle path."""
         return self._path
 
+    def _get_member_path(self, info):
+        """Get the path of a member relative to the root directory of the
+        bundle, None for the root directory itself."""
+        name = info.filename
+        parts = name.rstrip('/').split('/')
+        if name.startswith('/') or '\\' in name or parts[0] != \
+                self._zip_root_dir or '..' in parts[1:] or '' in parts:
+            raise MalformedBundleException('Invalid path %r in bundle %s' %
+                                           (name, self._path))
+
+        if stat.S_ISLNK(info.external_attr >> 16):
+            target = self._zip_file.read(info)
+            target_parts = target.split('/')
+            depth = len(parts) - 2
+            for part in target_parts:
+                if part == '..':
+                    depth -= 1
+                elif part not in ('', '.'):
+                    depth += 1
+                if depth < 0:
+                    break
+            if target.startswith('/') or depth < 0:
+                raise MalformedBundleException(
+                    'Link %r points outside of bundle %s' %
+                    (name, self._path))
+
+        if len(parts) == 1:
+            return None
+        return os.path.join(*parts[1:])
+
     def _unzip(self, install_dir):
         if self._zip_file is None:
             raise AlreadyInstalledException
 
+        directories = set()
+        members = []
+        for info in self._zip_file.infolist():
+            if info.filename == 'mimetype':
+                continue
+            path = self._get_member_path(info)
+            if path is None:
+                continue
+            if info.filename.endswith('/'):
+                directories.add(path)
+            else:
+                directories.add(os.path.dirname(path))
+                members.append((info, path))
+
+        paths = set()
+        links = set()
+        for info, path in members:
+            if path in directories:
+                raise MalformedBundleException(
+                    'File %r is also a directory in bundle %s' %
+                    (info.filename, self._path))
+            if path in paths:
+                raise MalformedBundleException(
+                    'File %r is twice in bundle %s' %
+                    (info.filename, self._path))
+            paths.add(path)
+            if stat.S_ISLNK(info.external_attr >> 16):
+                links.add(path)
+
+        # Nothing is written through the links of the bundle, wherever
+        # they point to
+        for path in paths.union(directories):
+            parent = os.path.dirname(path)
+            while parent:
+                if parent in links:
+                    raise MalformedBundleException(
+                        'Path %r is inside the link %r in bundle %s' %
+                        (path, parent, self._path))
+                parent = os.path.dirname(parent)
+
         if not os.path.isdir(install_dir):
             os.mkdir(install_dir, 0775)
 
-        # zipfile provides API that in theory would let us do this
-        # correctly by hand, but handling all the oddities of
-        # Windows/UNIX mappings, extension attributes, deprecated
-        # features, etc makes it impractical.
-        if os.spawnlp(os.P_WAIT, 'unzip', 'unzip', '-o', self._path,
-                      '-x', 'mimetype', '-d', install_dir):
-            # clean up install dir after failure
-            shutil.rmtree(os.path.join(install_dir, self._zip_root_dir),
-                          ignore_errors=True)
-            # indicate failure.
-            raise ZipExtractException
+        # Extract next to the final location, so that it can be renamed
+        # into place once complete, and nothing is left on failure
+        install_path = os.path.join(install_dir, self._zip_root_dir)
+        temp_path = tempfile.mkdtemp(prefix='.' + self._zip_root_dir,
+                                     dir=install_dir)
+        try:
+            os.chmod(temp_path, 0775)
+            for directory in sorted(directories):
+                directory_path = os.path.join(temp_path, directory)
+                if not os.path.isdir(directory_path):
+                    os.makedirs(directory_path, 0775)
+
+            _ZipExtractor(self._path, members, temp_path).run()
+
+            # The targets were checked by name only, a link can point
+            # outside through other links
+            root_path = os.path.realpath(temp_path)
+            for path in links:
+                target = os.path.realpath(os.path.join(temp_path, path))
+                if target != root_path and \
+                        not target.startswith(root_path + os.sep):
+                    raise MalformedBundleException(
+                        'Link %r points outside of bundle %s' %
+                        (path, self._path))
+
+            if os.path.lexists(install_path):
+                old_path = tempfile.mkdtemp(prefix='.' + self._zip_root_dir,
+                                            dir=install_dir)
+                os.rename(install_path, os.path.join(old_path, 'old'))
+                os.rename(temp_path, install_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+            else:
+                os.rename(temp_path, install_path)
+        except MalformedBundleException:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        except (ZipExtractException, OSError, IOError), e:
+            logging.error('Error extracting %s: %s', self._path, e)
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise ZipExtractException(e)
 
     def _zip(self, bundle_path):
         if self._zip_file is not None:
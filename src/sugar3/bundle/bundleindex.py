@@ -0,0 +1,196 @@
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Index of the activity bundles installed
+
+UNSTABLE.
+"""
+
+import os
+import json
+import logging
+import tempfile
+
+from sugar3 import env
+from sugar3.bundle.bundle import MalformedBundleException
+from sugar3.bundle.activitybundle import ActivityBundle
+
+_INDEX_VERSION = 2
+
+
+def _encode(value):
+    # ConfigParser gives str, keep them so
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    elif isinstance(value, dict):
+        return dict([(_encode(key), _encode(item))
+                     for key, item in value.items()])
+    return value
+
+
+def _get_stamp(path):
+    stamp = [os.stat(path).st_mtime]
+    # Editing activity.info does not change the mtime of the bundle
+    info_path = os.path.join(path, 'activity', 'activity.info')
+    if os.path.isfile(info_path):
+        stamp.append(os.stat(info_path).st_mtime)
+    return stamp
+
+
+def _get_local_stamp(path, lang):
+    # Translations are updated without touching activity.info, as by
+    # build_locale, see ActivityBundle._get_linfo_file() for the paths
+    stamp = []
+    if lang:
+        for locale_name in [lang, lang[:2]]:
+            linfo_path = os.path.join(path, 'locale', locale_name,
+                                      'activity.linfo')
+            try:
+                stamp.append(os.stat(linfo_path).st_mtime)
+            except OSError:
+                stamp.append(None)
+    return stamp
+
+
+class ActivityBundleIndex(object):
+    """The activity.info data of activity bundles, stored in a single file.
+
+    The data of a bundle is used as long as the mtimes of the bundle and
+    of its activity.info did not change, so that only the bundles which
+    changed are parsed again. The localized name, summary and tags are
+    indexed for each locale they were asked for, and used as long as the
+    mtimes of the activity.linfo of the locale did not change either.
+
+    Keyword arguments:
+    index_path -- path of the index file (default activity-bundles.json
+                  in the profile)
+
+    """
+
+    def __init__(self, index_path=None):
+        if index_path is None:
+            index_path = env.get_profile_path('activity-bundles.json')
+        self._index_path = index_path
+        self._bundles = {}
+        self._changed = False
+
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._index_path) as index_file:
+                index = json.load(index_file)
+        except (IOError, ValueError):
+            return
+
+        if index.get('version') != _INDEX_VERSION:
+            logging.debug('Ignoring bundle index of version %s',
+                          index.get('version'))
+            return
+        self._bundles = _encode(index['bundles'])
+
+    def save(self):
+        """Write the index file, if the index changed."""
+        if not self._changed:
+            return
+
+        index = {'version': _INDEX_VERSION, 'bundles': self._bundles}
+        index_dir = os.path.dirname(self._index_path)
+        fd, temp_path = tempfile.mkstemp(dir=index_dir,
+                                         prefix='.activity-bundles')
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(index, index_file, separators=(',', ':'))
+            os.rename(temp_path, self._index_path)
+        except (IOError, OSError):
+            logging.exception('Could not write the bundle index %s',
+                              self._index_path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self._changed = False
+
+    def get_info(self, bundle):
+        """Return the indexed data of the bundle, or None if it changed."""
+        entry = self._bundles.get(bundle.get_path())
+        if entry is None or entry['stamp'] != _get_stamp(bundle.get_path()):
+            return None
+        return entry['info']
+
+    def get_local_info(self, bundle, lang):
+        """Return the indexed localized data of the bundle for lang, or
+        None if it changed."""
+        entry = self._bundles.get(bundle.get_path())
+        if entry is None:
+            return None
+
+        local_entry = entry['locales'].get(lang)
+        if local_entry is None or \
+                local_entry['stamp'] != _get_local_stamp(bundle.get_path(),
+                                                         lang):
+            return None
+        return local_entry['info']
+
+    def set_info(self, bundle, info, lang, local_info):
+        """Index the data of the bundle, and its localized data for lang."""
+        path = bundle.get_path()
+        stamp = _get_stamp(path)
+
+        entry = self._bundles.get(path)
+        if entry is None or entry['stamp'] != stamp:
+            entry = {'stamp': stamp, 'info': info, 'locales': {}}
+            self._bundles[path] = entry
+
+        entry['locales'][lang] = {'stamp': _get_local_stamp(path, lang),
+                                  'info': local_info}
+        self._changed = True
+
+    def remove(self, path):
+        """Remove the bundle of path from the index."""
+        if path in self._bundles:
+            del self._bundles[path]
+            self._changed = True
+
+    def get_bundle(self, path):
+        """Get the ActivityBundle of path, parsing it only if it changed."""
+        return ActivityBundle(path, index=self)
+
+    def refresh(self, paths):
+        """Get the ActivityBundles of paths and save the index.
+
+        The bundles which are not in paths anymore are removed from the
+        index, and the malformed or unreadable ones are skipped.
+
+        Return: list of ActivityBundle
+
+        """
+        bundles = []
+        for path in paths:
+            try:
+                bundles.append(self.get_bundle(path))
+            except (MalformedBundleException, IOError, OSError):
+                logging.exception('Error loading bundle %r', path)
+                self.remove(path)
+
+        for path in set(self._bundles.keys()) - set(paths):
+            self.remove(path)
+
+        self.save()
+        return bundles
@@ -0,0 +1,217 @@
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""Index of the activities supporting each MIME type
+
+UNSTABLE.
+"""
+
+import os
+import json
+import logging
+import tempfile
+
+from sugar3 import env
+from sugar3 import mime
+
+_INDEX_VERSION = 1
+
+_mime_type_index = None
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_encode(item) for item in value]
+    elif isinstance(value, dict):
+        return dict([(_encode(key), _encode(item))
+                     for key, item in value.items()])
+    return value
+
+
+class MimeTypeIndex(object):
+    """The bundle ids of the activities supporting each MIME type.
+
+    The activities supporting a parent of a MIME type are listed too, the
+    parents being looked up once per MIME type. The index is shared by
+    the processes through a file in the profile, it is reloaded when
+    another process changed it.
+
+    Keyword arguments:
+    index_path -- path of the index file (default mime-types.json in the
+                  profile)
+
+    """
+
+    def __init__(self, index_path=None):
+        if index_path is None:
+            index_path = env.get_profile_path('mime-types.json')
+        self._index_path = index_path
+        # The file is replaced on each save, so a change of inode tells
+        # a change too quick for the modification time
+        self._stamp = None
+
+        self._mime_types = {}
+        self._ancestors = {}
+        self._bundle_ids = {}
+        self._lookups = {}
+
+        self._load()
+
+    def _load(self):
+        self._mime_types = {}
+        self._ancestors = {}
+        self._stamp = None
+        try:
+            self._stamp = self._get_stamp()
+            with open(self._index_path) as index_file:
+                index = _encode(json.load(index_file))
+        except (OSError, IOError, ValueError):
+            index = {}
+
+        if index.get('version') == _INDEX_VERSION:
+            self._mime_types = index['bundles']
+            self._ancestors = index['ancestors']
+        self._update_bundle_ids()
+
+    def _get_stamp(self):
+        stat = os.stat(self._index_path)
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def _check_file(self):
+        try:
+            stamp = self._get_stamp()
+        except OSError:
+            stamp = None
+        if stamp != self._stamp:
+            self._load()
+
+    def _save(self):
+        index = {'version': _INDEX_VERSION,
+                 'bundles': self._mime_types,
+                 'ancestors': self._ancestors}
+        index_dir = os.path.dirname(self._index_path)
+        fd, temp_path = tempfile.mkstemp(dir=index_dir,
+                                         prefix='.mime-types')
+        try:
+            with os.fdopen(fd, 'w') as index_file:
+                json.dump(index, index_file, separators=(',', ':'))
+            os.rename(temp_path, self._index_path)
+            self._stamp = self._get_stamp()
+        except (IOError, OSError):
+            logging.exception('Could not write the MIME type index %s',
+                              self._index_path)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _update_bundle_ids(self):
+        self._bundle_ids = {}
+        for bundle_id, mime_types in self._mime_types.items():
+            for mime_type in mime_types:
+                self._bundle_ids.setdefault(mime_type, []).append(bundle_id)
+        self._lookups = {}
+
+    def _get_ancestors(self, mime_type):
+        if mime_type not in self._ancestors:
+            ancestors = []
+            pending = [mime_type]
+            while pending:
+                for parent in mime.get_mime_parents(pending.pop(0)):
+                    if parent != mime_type and parent not in ancestors:
+                        ancestors.append(parent)
+                        pending.append(parent)
+            self._ancestors[mime_type] = ancestors
+        return self._ancestors[mime_type]
+
+    def get_bundle_ids(self, mime_type):
+        """Get the bundle ids of the activities supporting mime_type.
+
+        The activities supporting it directly come first, then the ones
+        supporting its parents, closest parents first.
+
+        Return: list of bundle ids
+
+        """
+        self._check_file()
+
+        if mime_type not in self._lookups:
+            ancestors_count = len(self._ancestors)
+            bundle_ids = []
+            for candidate in [mime_type] + self._get_ancestors(mime_type):
+                for bundle_id in self._bundle_ids.get(candidate, []):
+                    if bundle_id not in bundle_ids:
+                        bundle_ids.append(bundle_id)
+            self._lookups[mime_type] = bundle_ids
+
+            if len(self._ancestors) != ancestors_count:
+                self._save()
+
+        return list(self._lookups[mime_type])
+
+    def set_bundle(self, bundle_id, mime_types):
+        """Index the MIME types supported by an activity.
+
+        Keyword arguments:
+        bundle_id -- bundle id of the activity
+        mime_types -- list of the MIME types it supports, or None
+
+        """
+        self._check_file()
+        self._mime_types[bundle_id] = list(mime_types or [])
+        self._update_bundle_ids()
+        self._save()
+
+    def remove_bundle(self, bundle_id):
+        """Remove an activity from the index."""
+        self._check_file()
+        if bundle_id in self._mime_types:
+            del self._mime_types[bundle_id]
+            self._update_bundle_ids()
+            self._save()
+
+    def refresh(self, bundles):
+        """Index exactly the activity bundles given.
+
+        Keyword arguments:
+        bundles -- list of all the ActivityBundles installed
+
+        """
+        self._check_file()
+        mime_types = dict([(bundle.get_bundle_id(),
+                            list(bundle.get_mime_types() or []))
+                           for bundle in bundles])
+        if mime_types != self._mime_types:
+            self._mime_types = mime_types
+            self._update_bundle_ids()
+            self._save()
+
+    def clear_ancestors(self):
+        """Forget the parents of the MIME types, after the MIME database
+        has been updated."""
+        self._check_file()
+        self._ancestors = {}
+        self._lookups = {}
+        self._save()
+
+
+def get_mime_type_index():
+    global _mime_type_index
+
+    if _mime_type_index is None:
+        _mime_type_index = MimeTypeIndex()
+    return _mime_type_index
@@ -22,18 +22,26 @@ STABLE
 
 import logging
 import time
+import mmap
 from datetime import datetime
 import os
 import tempfile
+import weakref
+from errno import EEXIST, EXDEV, EPERM, EMLINK
+from functools import partial
+from contextlib import contextmanager
 from gi.repository import GObject
+from gi.repository import GLib
 from gi.repository import GConf
 from gi.repository import Gio
+from gi.repository import GdkPixbuf
 import dbus
 import dbus.glib
 
 from sugar3 import env
 from sugar3 import mime
 from sugar3 import dispatch
+from sugar3.util import SizedLRU
 
 DS_DBUS_SERVICE = 'org.laptop.sugar.DataStore'
 DS_DBUS_INTERFACE = 'org.laptop.sugar.DataStore'
@@ -41,6 +49,23 @@ DS_DBUS_PATH = '/org/laptop/sugar/DataStore'
 
 _data_store = None
 
+# Byte budget of the metadata cache, previews are the bulk of it
+_METADATA_CACHE_SIZE = 4 * 1024 * 1024
+
+# The well-known properties of an entry, but the preview
+PROPERTIES_WITHOUT_PREVIEW = ['uid', 'activity', 'activity_id', 'title',
+                              'title_set_by_user', 'keep', 'ctime', 'mtime',
+                              'timestamp', 'creation_time', 'filesize',
+                              'icon-color', 'mime_type', 'share-scope',
+                              'buddies', 'description', 'tags',
+                              'launch-times', 'mountpoint']
+
+# Milliseconds schedule_write() waits for more changes before writing
+_WRITE_DELAY = 1000
+
+# Requests sent at once by the bulk operations, see get_many()
+_MAX_IN_FLIGHT = 8
+
 
 def _get_data_store():
     global _data_store
@@ -50,31 +75,359 @@ def _get_data_store():
         _data_store = dbus.Interface(_bus.get_object(DS_DBUS_SERVICE,
                                                      DS_DBUS_PATH),
                                      DS_DBUS_INTERFACE)
-        _data_store.connect_to_signal('Created', __datastore_created_cb)
-        _data_store.connect_to_signal('Deleted', __datastore_deleted_cb)
-        _data_store.connect_to_signal('Updated', __datastore_updated_cb)
+        _connect_to_signals(_data_store)
 
     return _data_store
 
 
+def _connect_to_signals(data_store):
+    data_store.connect_to_signal('Created', __datastore_created_cb)
+    data_store.connect_to_signal('Deleted', __datastore_deleted_cb)
+    data_store.connect_to_signal('Updated', __datastore_updated_cb)
+
+
+def set_backend(backend):
+    """Use another datastore than the service of the session bus.
+
+    A backend has the methods of the org.laptop.sugar.DataStore D-Bus
+    interface used by this module, with the same arguments: create,
+    update, delete, find, get_properties, get_filename and
+    get_uniquevaluesfor, taking the reply_handler, error_handler,
+    byte_arrays and timeout keyword arguments of D-Bus proxy methods.
+    It also has connect_to_signal(), for the Created, Updated and
+    Deleted signals. See sugar3.datastore.localstore for an in-process
+    one, for tests and benchmarks.
+
+    Keyword arguments:
+    backend -- the datastore to use
+
+    """
+    global _data_store
+
+    _data_store = backend
+    _metadata_cache.clear()
+    _unique_values.clear()
+    _connect_to_signals(backend)
+
+
 def __datastore_created_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
-    updated.send(None, object_id=object_id, metadata=metadata)
+    _metadata_cache.invalidate(object_id)
+    # Only fetch the properties if somebody wants them
+    if updated.receivers:
+        metadata = _get_properties(object_id)
+        _unique_values.entry_changed(object_id, metadata)
+        updated.send(None, object_id=object_id, metadata=metadata)
+    elif _unique_values.is_active():
+        __queue_update(object_id)
 
 
 def __datastore_updated_cb(object_id):
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
-    updated.send(None, object_id=object_id, metadata=metadata)
+    _unique_values.entry_changing(object_id)
+    _metadata_cache.invalidate(object_id)
+    __queue_update(object_id)
+
+
+def __queue_update(object_id):
+    global _updates_sid
+
+    # Entries are often updated several times in a row, refresh them once
+    _pending_updates.add(object_id)
+    if _updates_sid is None:
+        _updates_sid = GLib.idle_add(__process_updates_cb)
+
+
+def __process_updates_cb():
+    global _updates_sid
+
+    _updates_sid = None
+    object_ids = list(_pending_updates)
+    _pending_updates.clear()
+
+    unique_values_ids = []
+    for object_id in object_ids:
+        ds_objects = _ds_objects.get(object_id)
+        if ds_objects is not None and not ds_objects:
+            del _ds_objects[object_id]
+            ds_objects = None
+
+        if not (ds_objects or updated.receivers):
+            if _unique_values.is_active():
+                unique_values_ids.append(object_id)
+            continue
+
+        try:
+            metadata = _get_properties(object_id)
+        except dbus.DBusException:
+            logging.exception('Could not refresh entry %s', object_id)
+            continue
+
+        _unique_values.entry_changed(object_id, metadata)
+        for ds_object in list(ds_objects or []):
+            ds_object._refresh_metadata(metadata)
+        updated.send(None, object_id=object_id, metadata=metadata)
+
+    if unique_values_ids:
+        __fetch_unique_values(unique_values_ids)
+
+    return False
+
+
+def __fetch_unique_values(object_ids):
+    # Only the properties of get_unique_values(), of all the entries at
+    # once, the entries deleted meanwhile are not found
+
+    def reply_cb(entries, total_count_):
+        for entry in entries:
+            _unique_values.entry_changed(entry['uid'], entry)
+
+    def error_cb(error):
+        logging.error('Could not fetch the unique values of %s: %s',
+                      object_ids, error)
+        _unique_values.entries_unknown(object_ids)
+
+    keys = _unique_values.get_keys()
+    _get_data_store().find({'uid': object_ids}, keys + ['uid'],
+                           reply_handler=reply_cb, error_handler=error_cb,
+                           byte_arrays=True)
 
 
 def __datastore_deleted_cb(object_id):
+    # Before the metadata of the entry is dropped
+    _unique_values.entry_deleted(object_id)
+    _metadata_cache.invalidate(object_id)
+    _pending_updates.discard(object_id)
     deleted.send(None, object_id=object_id)
 
+
+def _track_ds_object(ds_object, object_id):
+    if object_id not in _ds_objects:
+        _ds_objects[object_id] = weakref.WeakSet()
+    _ds_objects[object_id].add(ds_object)
+
+
+def _untrack_ds_object(ds_object, object_id):
+    ds_objects = _ds_objects.get(object_id)
+    if ds_objects is not None:
+        ds_objects.discard(ds_object)
+        if not ds_objects:
+            del _ds_objects[object_id]
+
+
+# The DSObjects to refresh on updates, by uid, all of them are served by
+# the single Updated signal match of the module
+_ds_objects = {}
+_pending_updates = set()
+_updates_sid = None
+
+
 created = dispatch.Signal()
 deleted = dispatch.Signal()
 updated = dispatch.Signal()
+# Sent with operation, done and total as bulk operations progress
+progress = dispatch.Signal()
+
+try:
+    _get_data_store()
+except dbus.DBusException:
+    # Until it is started, or another backend is set
+    logging.warning('The datastore service is not available.')
+
+
+def _get_metadata_size(entry):
+    properties, complete_ = entry
+
+    size = 0
+    for key, value in properties.items():
+        size += len(key)
+        if isinstance(value, basestring):
+            size += len(value)
+        else:
+            size += 8
+    return size
+
+
+class _MetadataCache(object):
+    """Metadata of the datastore entries, shared by the whole process.
+
+    It is filled with the results of get() and find() and entries are
+    dropped when the datastore signals that they changed, so they are
+    only fetched again when used. An entry can hold only some of the
+    properties, when they come from a find() asking for a list of them.
+    """
+
+    def __init__(self):
+        self._entries = SizedLRU(_METADATA_CACHE_SIZE, _get_metadata_size)
+
+    def get(self, object_id, properties=None):
+        """Return a copy of the cached properties, or None.
+
+        Keyword arguments:
+        properties -- list of the properties needed, all of them if None
+
+        """
+        entry = self._entries.get(object_id)
+        if entry is None:
+            return None
+
+        cached_properties, complete = entry
+        if not complete:
+            if properties is None:
+                return None
+            for key in properties:
+                if key not in cached_properties:
+                    return None
+
+        return cached_properties.copy()
+
+    def set(self, object_id, properties, complete=True):
+        entry = self._entries.get(object_id)
+        if entry is not None and not complete:
+            # Don't lose properties fetched before
+            cached_properties, complete = entry
+            cached_properties = cached_properties.copy()
+            cached_properties.update(properties)
+            properties = cached_properties
+
+        self._entries[object_id] = (properties.copy(), complete)
+
+    def invalidate(self, object_id):
+        if object_id in self._entries:
+            del self._entries[object_id]
+
+    def clear(self):
+        self._entries = SizedLRU(_METADATA_CACHE_SIZE, _get_metadata_size)
+
+
+_metadata_cache = _MetadataCache()
+
+
+class _UniqueValuesCache(object):
+    """Unique values of the properties asked to get_unique_values().
+
+    The values of the entries created or updated are added from their
+    properties, fetched anyway to refresh the DSObjects. An entry deleted
+    or updated may have held the last occurrence of a value, so the
+    values of a property are asked to the datastore again the next time
+    they are needed when such an entry had a value for it, or when its
+    previous values are not known from the metadata cache.
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._stale = set()
+        self._previous = {}
+
+    def is_active(self):
+        return bool(self._values)
+
+    def get_keys(self):
+        return self._values.keys()
+
+    def get(self, key):
+        if key not in self._values or key in self._stale:
+            values = _get_data_store().get_uniquevaluesfor(
+                key, dbus.Dictionary({}, signature='ss'))
+            self._values[key] = set(values)
+            self._stale.discard(key)
+        return list(self._values[key])
+
+    def entry_changing(self, object_id):
+        """Remember the values of an entry before it is fetched again,
+        None if they are not cached."""
+        if self._values and object_id not in self._previous:
+            self._previous[object_id] = _metadata_cache.get(
+                object_id, self._values.keys())
+
+    def entry_changed(self, object_id, properties):
+        changing = object_id in self._previous
+        previous = self._previous.pop(object_id, None)
+        for key, values in self._values.items():
+            value = properties.get(key)
+            if changing and previous is None and value is not None:
+                # The previous value is unknown, it may not be used anymore
+                self._stale.add(key)
+            elif previous is not None and key in previous and \
+                    previous[key] != value:
+                # The previous value may not be used anymore
+                self._stale.add(key)
+            elif value is not None:
+                values.add(value)
+
+    def entries_unknown(self, object_ids):
+        """Forget the values of entries which could not be fetched."""
+        for object_id in object_ids:
+            self._previous.pop(object_id, None)
+        self._stale.update(self._values.keys())
+
+    def entry_deleted(self, object_id):
+        if object_id in self._previous:
+            previous = self._previous.pop(object_id)
+        else:
+            previous = _metadata_cache.get(object_id, self._values.keys())
+        for key in self._values:
+            if previous is None or previous.get(key) is not None:
+                self._stale.add(key)
+
+    def clear(self):
+        self._values = {}
+        self._stale.clear()
+        self._previous = {}
+
+
+_unique_values = _UniqueValuesCache()
+
+
+def _get_properties(object_id, properties=None):
+    cached_properties = _metadata_cache.get(object_id, properties)
+    if cached_properties is not None:
+        return cached_properties
+
+    if properties is None:
+        metadata = _get_data_store().get_properties(object_id,
+                                                    byte_arrays=True)
+        _metadata_cache.set(object_id, metadata)
+    else:
+        entries, count_ = _get_data_store().find({'uid': object_id},
+                                                 properties,
+                                                 byte_arrays=True)
+        if not entries:
+            raise ValueError('No datastore entry with uid %s' % object_id)
+        metadata = entries[0]
+        _metadata_cache.set(object_id, metadata, complete=False)
+
+    return metadata
+
+
+def _complete_metadata(ds_object):
+    """Fetch the properties missing from the metadata of ds_object."""
+    ds_object.metadata.merge(_get_properties(ds_object.object_id))
+
+
+def _request_complete_metadata(ds_object, reply_handler, error_handler):
+    """Fetch the properties missing from the metadata of ds_object
+    asynchronously, reply_handler is called without arguments once done."""
+    metadata = ds_object.metadata
+    if ds_object.object_id is None or metadata.is_complete():
+        reply_handler()
+        return
+
+    properties = _metadata_cache.get(ds_object.object_id)
+    if properties is not None:
+        metadata.merge(properties)
+        reply_handler()
+        return
 
-_get_data_store()
+    def properties_cb(properties):
+        _metadata_cache.set(ds_object.object_id, properties)
+        # Unless a synchronous write completed it meanwhile
+        if not metadata.is_complete():
+            metadata.merge(properties)
+        reply_handler()
+
+    _get_data_store().get_properties(ds_object.object_id,
+                                     reply_handler=properties_cb,
+                                     error_handler=error_handler,
+                                     byte_arrays=True)
 
 
 class DSMetadata(GObject.GObject):
@@ -83,12 +436,14 @@ class DSMetadata(GObject.GObject):
         'updated': (GObject.SignalFlags.RUN_FIRST, None, ([])),
     }
 
-    def __init__(self, properties=None):
+    def __init__(self, properties=None, complete=True):
         GObject.GObject.__init__(self)
         if not properties:
             self._properties = {}
         else:
             self._properties = properties
+        # False when only some of the properties of the entry were fetched
+        self._complete = complete
 
         default_keys = ['activity', 'activity_id',
                         'mime_type', 'title_set_by_user']
@@ -96,16 +451,72 @@ class DSMetadata(GObject.GObject):
             if key not in self._properties:
                 self._properties[key] = ''
 
+        self._changed_keys = set()
+        self._batch_depth = 0
+        self._batch_updated = False
+
     def __getitem__(self, key):
         return self._properties[key]
 
     def __setitem__(self, key, value):
         if key not in self._properties or self._properties[key] != value:
             self._properties[key] = value
-            self.emit('updated')
+            self._changed_keys.add(key)
+            if self._batch_depth:
+                self._batch_updated = True
+            else:
+                self.emit('updated')
 
     def __delitem__(self, key):
         del self._properties[key]
+        self._changed_keys.add(key)
+
+    @contextmanager
+    def batch_update(self):
+        """Context manager to change several keys at once.
+
+        The updated signal is emitted once at the end of the block, if
+        anything changed, instead of once per key.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._batch_updated:
+                self._batch_updated = False
+                self.emit('updated')
+
+    def get_changed_keys(self):
+        """Return the keys set or deleted since the last write."""
+        return set(self._changed_keys)
+
+    def clear_changes(self, keys=None):
+        """Forget the changes of the keys given, of all of them if None."""
+        if keys is None:
+            self._changed_keys.clear()
+        else:
+            self._changed_keys.difference_update(keys)
+
+    def is_complete(self):
+        """Return False if only some of the properties of the entry are
+        held, as with find() given a list of properties."""
+        return self._complete
+
+    def merge(self, properties):
+        """Complete the metadata with all the properties of the entry,
+        keeping the changes not written yet."""
+        merged = dict(properties)
+        for key in self._changed_keys:
+            if key in self._properties:
+                merged[key] = self._properties[key]
+            elif key in merged:
+                del merged[key]
+
+        # Not a change of the entry, don't emit updated
+        self._properties.clear()
+        self._properties.update(merged)
+        self._complete = True
 
     def __contains__(self, key):
         return self._properties.__contains__(key)
@@ -121,7 +532,7 @@ class DSMetadata(GObject.GObject):
         return self._properties
 
     def copy(self):
-        return DSMetadata(self._properties.copy())
+        return DSMetadata(self._properties.copy(), self._complete)
 
     def get(self, key, default=None):
         if key in self._properties:
@@ -131,46 +542,61 @@ class DSMetadata(GObject.GObject):
 
     def update(self, properties):
         """Update all of the metadata"""
-        for (key, value) in properties.items():
-            self[key] = value
+        with self.batch_update():
+            for (key, value) in properties.items():
+                self[key] = value
 
 
 class DSObject(object):
     """A representation of a DS entry."""
 
     def __init__(self, object_id, metadata=None, file_path=None):
-        self._update_signal_match = None
         self._object_id = None
+        self._creating = False
+        self._fetching = False
+        self._queued_writes = []
+        self._write_sid = None
+        self._write_update_mtime = False
 
         self.set_object_id(object_id)
 
         self._metadata = metadata
         self._file_path = file_path
+        # Whether the file is to be sent with the next write, see write()
+        self._file_changed = file_path is not None
         self._destroyed = False
         self._owns_file = False
+        self._thumbnails = {}
 
     def get_object_id(self):
         return self._object_id
 
     def set_object_id(self, object_id):
-        if self._update_signal_match is not None:
-            self._update_signal_match.remove()
+        if self._object_id is not None:
+            _untrack_ds_object(self, self._object_id)
         if object_id is not None:
-            self._update_signal_match = _get_data_store().connect_to_signal(
-                    'Updated', self.__object_updated_cb, arg0=object_id)
+            _track_ds_object(self, object_id)
 
         self._object_id = object_id
 
     object_id = property(get_object_id, set_object_id)
 
-    def __object_updated_cb(self, object_id):
-        properties = _get_data_store().get_properties(self._object_id,
-                                                      byte_arrays=True)
+    def _refresh_metadata(self, properties):
+        if self._metadata is None:
+            return
+
+        # Keep the changes not written yet, see schedule_write()
+        changed_keys = self._metadata.get_changed_keys()
+        properties = dict([(key, value) for key, value in properties.items()
+                           if key not in changed_keys])
         self._metadata.update(properties)
+        # Those come from the datastore, they are not changes to write
+        self._metadata.clear_changes(properties.keys())
+        self._metadata._complete = True
 
     def get_metadata(self):
         if self._metadata is None and not self.object_id is None:
-            properties = _get_data_store().get_properties(self.object_id)
+            properties = _get_properties(self.object_id)
             metadata = DSMetadata(properties)
             self._metadata = metadata
         return self._metadata
@@ -181,10 +607,39 @@ class DSObject(object):
 
     metadata = property(get_metadata, set_metadata)
 
+    def get_preview(self, width=None, height=None):
+        """Get the preview of the entry, fetching it on first access.
+
+        Keyword arguments:
+        width -- if given with height, return a thumbnail scaled to fit in
+                 width x height instead (default None)
+        height -- see width (default None)
+
+        Return: PNG data, or None if the entry has no preview
+
+        """
+        metadata = self.get_metadata()
+        if 'preview' not in metadata and self.object_id is not None:
+            properties = _get_properties(self.object_id, ['preview'])
+            if 'preview' in properties:
+                # Not a change of the entry, don't emit updated
+                metadata.get_dictionary()['preview'] = properties['preview']
+
+        preview = metadata.get('preview')
+        if not preview or width is None or height is None:
+            return preview
+
+        if (width, height) not in self._thumbnails:
+            self._thumbnails[(width, height)] = _scale_preview(preview, width,
+                                                               height)
+        return self._thumbnails[(width, height)]
+
     def get_file_path(self, fetch=True):
         if fetch and self._file_path is None and not self.object_id is None:
             self.set_file_path(_get_data_store().get_filename(self.object_id))
             self._owns_file = True
+            # A copy of the file of the entry, not a change of it
+            self._file_changed = False
         return self._file_path
 
     def set_file_path(self, file_path):
@@ -194,14 +649,34 @@ class DSObject(object):
                     os.remove(self._file_path)
                 self._owns_file = False
             self._file_path = file_path
+            self._file_changed = True
 
     file_path = property(get_file_path, set_file_path)
 
+    def open_file(self):
+        """Open the file of the entry for reading.
+
+        Return: a file object
+
+        """
+        return open(self.get_file_path(), 'rb')
+
+    def map_file(self):
+        """Map the file of the entry in memory, read only.
+
+        Return: an mmap object, or None if the file is empty
+
+        """
+        return _map_file(self.get_file_path())
+
     def destroy(self):
         if self._destroyed:
             logging.warning('This DSObject has already been destroyed!.')
             return
         self._destroyed = True
+        if self._write_sid is not None:
+            # Don't lose the changes waiting for a scheduled write
+            _run_scheduled_write(self, asynchronous=False)
         if self._file_path and self._owns_file:
             if os.path.isfile(self._file_path):
                 os.remove(self._file_path)
@@ -218,6 +693,21 @@ class DSObject(object):
         return DSObject(None, self._metadata.copy(), self._file_path)
 
 
+def _scale_preview(preview, width, height):
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(preview)
+    loader.close()
+    pixbuf = loader.get_pixbuf()
+
+    scale = min(float(width) / pixbuf.get_width(),
+                float(height) / pixbuf.get_height())
+    pixbuf = pixbuf.scale_simple(max(int(pixbuf.get_width() * scale), 1),
+                                 max(int(pixbuf.get_height() * scale), 1),
+                                 GdkPixbuf.InterpType.BILINEAR)
+    success_, data = pixbuf.save_to_bufferv('png', [], [])
+    return data
+
+
 class RawObject(object):
     """A representation for objects not in the DS but
     in the file system.
@@ -254,15 +744,30 @@ class RawObject(object):
         # and w/o this, it wouldn't work since we have file from mounted device
         if self._file_path is None:
             data_path = os.path.join(env.get_profile_path(), 'data')
-            self._file_path = tempfile.mktemp(
-                    prefix='rawobject', dir=data_path)
             if not os.path.exists(data_path):
                 os.makedirs(data_path)
-            os.symlink(self.object_id, self._file_path)
+            self._file_path = _link_file(self.object_id, data_path,
+                                         'rawobject')
         return self._file_path
 
     file_path = property(get_file_path)
 
+    def open_file(self):
+        """Open the file for reading, without linking it first.
+
+        Return: a file object
+
+        """
+        return open(self.object_id, 'rb')
+
+    def map_file(self):
+        """Map the file in memory, read only, without linking it first.
+
+        Return: an mmap object, or None if the file is empty
+
+        """
+        return _map_file(self.object_id)
+
     def destroy(self):
         if self._destroyed:
             logging.warning('This RawObject has already been destroyed!.')
@@ -280,11 +785,50 @@ class RawObject(object):
             self.destroy()
 
 
-def get(object_id):
+def _link_file(file_path, dir_path, prefix):
+    """Link file_path in dir_path, with a hard link if the file system
+    allows it, so that the data is neither copied nor lost if the file
+    is renamed, and a symbolic link otherwise.
+
+    Return: path of the link
+
+    """
+    while True:
+        link_path = tempfile.mktemp(prefix=prefix, dir=dir_path)
+        try:
+            os.link(file_path, link_path)
+            return link_path
+        except OSError, e:
+            if e.errno == EEXIST:
+                continue
+            elif e.errno not in (EXDEV, EPERM, EMLINK):
+                raise
+
+        try:
+            os.symlink(file_path, link_path)
+            return link_path
+        except OSError, e:
+            if e.errno != EEXIST:
+                raise
+
+
+def _map_file(file_path):
+    with open(file_path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return None
+        # The mapping stays valid once the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def get(object_id, properties=None):
     """Get the properties of the object with the ID given.
 
+    The properties are served from a process wide cache when possible.
+
     Keyword arguments:
     object_id -- unique identifier of the object
+    properties -- list of the properties needed, all of them if None
+                  (default None)
 
     Return: a DSObject
 
@@ -294,9 +838,11 @@ def get(object_id):
     if object_id.startswith('/'):
         return RawObject(object_id)
 
-    metadata = _get_data_store().get_properties(object_id, byte_arrays=True)
+    metadata = _get_properties(object_id, properties)
 
-    ds_object = DSObject(object_id, DSMetadata(metadata), None)
+    ds_object = DSObject(object_id,
+                         DSMetadata(metadata, complete=properties is None),
+                         None)
     # TODO: register the object for updates
     return ds_object
 
@@ -331,12 +877,86 @@ def _update_ds_entry(uid, properties, filename, transfer_ownership=False,
                                  filename, transfer_ownership)
 
 
-def _create_ds_entry(properties, filename, transfer_ownership=False):
+def _create_ds_entry(properties, filename, transfer_ownership=False,
+        reply_handler=None, error_handler=None, timeout=-1):
+    if reply_handler and error_handler:
+        _get_data_store().create(dbus.Dictionary(properties), filename,
+                transfer_ownership,
+                reply_handler=reply_handler,
+                error_handler=error_handler,
+                timeout=timeout)
+        return None
+
     object_id = _get_data_store().create(dbus.Dictionary(properties), filename,
     transfer_ownership)
     return object_id
 
 
+def __create_reply_cb(ds_object, reply_handler, object_id):
+    logging.debug('Created object %s in the datastore.', object_id)
+    ds_object._creating = False
+    # Unless the object has been given another id meanwhile
+    if ds_object.object_id is None:
+        ds_object.object_id = object_id
+        ds_object.metadata['uid'] = object_id
+        ds_object.metadata.clear_changes(['uid'])
+    __flush_queued_writes(ds_object)
+
+    reply_handler(object_id)
+
+
+def __create_error_cb(ds_object, error_handler, error):
+    queued_writes = ds_object._queued_writes
+    ds_object._creating = False
+    ds_object._queued_writes = []
+
+    error_handler(error)
+    for write_args in queued_writes:
+        if write_args['error_handler'] is not None:
+            write_args['error_handler'](error)
+
+
+def __complete_reply_cb(ds_object):
+    ds_object._fetching = False
+    __flush_queued_writes(ds_object)
+
+
+def __complete_error_cb(ds_object, error):
+    queued_writes = ds_object._queued_writes
+    ds_object._fetching = False
+    ds_object._queued_writes = []
+
+    for write_args in queued_writes:
+        if write_args['error_handler'] is not None:
+            write_args['error_handler'](error)
+
+
+def __flush_queued_writes(ds_object):
+    queued_writes = ds_object._queued_writes
+    ds_object._queued_writes = []
+    if not queued_writes:
+        return
+
+    def reply_cb(*args):
+        for write_args in queued_writes:
+            if write_args['reply_handler'] is not None:
+                write_args['reply_handler'](*args)
+
+    def error_cb(error):
+        for write_args in queued_writes:
+            if write_args['error_handler'] is not None:
+                write_args['error_handler'](error)
+
+    # The writes queued meanwhile become a single update
+    write(ds_object,
+          update_mtime=any([w['update_mtime'] for w in queued_writes]),
+          transfer_ownership=any([w['transfer_ownership']
+                                  for w in queued_writes]),
+          reply_handler=reply_cb,
+          error_handler=error_cb,
+          timeout=queued_writes[-1]['timeout'])
+
+
 def write(ds_object, update_mtime=True, transfer_ownership=False,
           reply_handler=None, error_handler=None, timeout=-1):
     """Write the DSObject given to the datastore. Creates a new entry if
@@ -349,45 +969,199 @@ def write(ds_object, update_mtime=True, transfer_ownership=False,
                           be passed - who is responsible to delete the file
                           when done with it (default False)
     reply_handler -- will be called with the method's return values as
-                     arguments (default None)
+                     arguments, the uid of the new entry for creates
+                     (default None)
     error_handler -- will be called with an instance of a DBusException
                      representing a remote exception (default None)
     timeout -- dbus timeout for the caller to wait (default -1)
 
+    When both handlers are given, creates are asynchronous too, and so is
+    the fetch of the properties missing from metadata coming from find()
+    with a property list. Until the uid of the new entry or the missing
+    properties are known, the later asynchronous writes of the DSObject
+    are queued and sent as a single update. A synchronous write fetches
+    the missing properties itself, and raises RuntimeError while the
+    entry is being created.
+
+    The file of the DSObject is only sent if it was set since the last
+    write, and it is forgotten once written with transfer_ownership, as
+    it is moved to the datastore then.
+
+    A write supersedes the pending schedule_write() of the DSObject.
+
     """
     logging.debug('datastore.write')
 
-    properties = ds_object.metadata.get_dictionary().copy()
+    if ds_object._write_sid is not None:
+        GLib.source_remove(ds_object._write_sid)
+        ds_object._write_sid = None
+        update_mtime = update_mtime or ds_object._write_update_mtime
+        ds_object._write_update_mtime = False
+
+    metadata = ds_object.metadata
+    asynchronous = reply_handler and error_handler
+    if ds_object._creating and not asynchronous:
+        raise RuntimeError('Entry still being created, it can only be '
+                           'written asynchronously')
+
+    # The datastore replaces all the properties of the entry on updates,
+    # don't drop those which were not fetched, see find()
+    fetch = ds_object.object_id and not metadata.is_complete()
+    if fetch and asynchronous and not ds_object._creating:
+        ds_object._fetching = True
+
+    if asynchronous and (ds_object._creating or ds_object._fetching):
+        logging.debug('Entry still being created or fetched, queuing the '
+                      'write.')
+        ds_object._queued_writes.append({
+            'update_mtime': update_mtime,
+            'transfer_ownership': transfer_ownership,
+            'reply_handler': reply_handler,
+            'error_handler': error_handler,
+            'timeout': timeout})
+        if fetch and len(ds_object._queued_writes) == 1:
+            _request_complete_metadata(
+                ds_object,
+                partial(__complete_reply_cb, ds_object),
+                partial(__complete_error_cb, ds_object))
+        return
+
+    if fetch:
+        _complete_metadata(ds_object)
+
+    properties = metadata.get_dictionary().copy()
+    changed_keys = metadata.get_changed_keys()
+    metadata.clear_changes()
 
     if update_mtime:
         properties['mtime'] = datetime.now().isoformat()
         properties['timestamp'] = int(time.time())
 
-    file_path = ds_object.get_file_path(fetch=False)
-    if file_path is None:
-        file_path = ''
-
-    # FIXME: this func will be sync for creates regardless of the handlers
-    # supplied. This is very bad API, need to decide what to do here.
-    if ds_object.object_id:
-        _update_ds_entry(ds_object.object_id,
-                         properties,
-                         file_path,
-                         transfer_ownership,
-                         reply_handler=reply_handler,
-                         error_handler=error_handler,
-                         timeout=timeout)
-    else:
-        if reply_handler or error_handler:
-            logging.warning('datastore.write() cannot currently be called' \
-                            'async for creates, see ticket 3071')
-        ds_object.object_id = _create_ds_entry(properties, file_path,
-                                               transfer_ownership)
-        ds_object.metadata['uid'] = ds_object.object_id
-        # TODO: register the object for updates
+    # Metadata only updates don't send the file again
+    file_path = ''
+    if ds_object._file_changed or not ds_object.object_id:
+        file_path = ds_object.get_file_path(fetch=False) or ''
+    unwritten = (changed_keys, file_path, ds_object._owns_file)
+    ds_object._file_changed = False
+    if file_path and transfer_ownership:
+        ds_object._file_path = None
+        ds_object._owns_file = False
+
+    if reply_handler and error_handler:
+        error_handler = partial(__write_error_cb, ds_object, unwritten,
+                                error_handler)
+
+    try:
+        if ds_object.object_id:
+            _unique_values.entry_changing(ds_object.object_id)
+            _metadata_cache.invalidate(ds_object.object_id)
+            _update_ds_entry(ds_object.object_id,
+                             properties,
+                             file_path,
+                             transfer_ownership,
+                             reply_handler=reply_handler,
+                             error_handler=error_handler,
+                             timeout=timeout)
+        elif reply_handler and error_handler:
+            ds_object._creating = True
+            _create_ds_entry(properties, file_path, transfer_ownership,
+                    reply_handler=partial(__create_reply_cb, ds_object,
+                                          reply_handler),
+                    error_handler=partial(__create_error_cb, ds_object,
+                                          error_handler),
+                    timeout=timeout)
+            return
+        else:
+            ds_object.object_id = _create_ds_entry(properties, file_path,
+                                                   transfer_ownership)
+            ds_object.metadata['uid'] = ds_object.object_id
+            ds_object.metadata.clear_changes(['uid'])
+    except dbus.DBusException:
+        _keep_unwritten(ds_object, unwritten)
+        raise
     logging.debug('Written object %s to the datastore.', ds_object.object_id)
 
 
+def _keep_unwritten(ds_object, unwritten):
+    # Still to be written, unless the DSObject was given another file
+    changed_keys, file_path, owns_file = unwritten
+    ds_object.metadata._changed_keys.update(changed_keys)
+    if file_path and ds_object._file_path in (None, file_path):
+        if ds_object._file_path is None:
+            ds_object._file_path = file_path
+            ds_object._owns_file = owns_file
+        ds_object._file_changed = True
+
+
+def __write_error_cb(ds_object, unwritten, error_handler, error):
+    _keep_unwritten(ds_object, unwritten)
+    error_handler(error)
+
+
+def schedule_write(ds_object, update_mtime=True, delay=_WRITE_DELAY):
+    """Write the DSObject given to the datastore after a while.
+
+    The writes scheduled meanwhile are merged into a single one, done
+    when no other write was scheduled for delay milliseconds, so that
+    changes made in a row to the metadata are written at once. Entries
+    whose metadata did not change since their last write are not written
+    again, use write() to store a new file.
+
+    Keyword arguments:
+    update_mtime -- boolean if the mtime of the entry should be regenerated
+                    (default True)
+    delay -- milliseconds to wait for other changes (default 1000)
+
+    """
+    if ds_object._write_sid is not None:
+        GLib.source_remove(ds_object._write_sid)
+
+    ds_object._write_update_mtime = ds_object._write_update_mtime or \
+        update_mtime
+    ds_object._write_sid = GLib.timeout_add(delay, __write_timeout_cb,
+                                            ds_object)
+
+
+def __write_timeout_cb(ds_object):
+    ds_object._write_sid = None
+    _run_scheduled_write(ds_object)
+    return False
+
+
+def _run_scheduled_write(ds_object, asynchronous=True):
+    if ds_object._write_sid is not None:
+        GLib.source_remove(ds_object._write_sid)
+        ds_object._write_sid = None
+    update_mtime = ds_object._write_update_mtime
+    ds_object._write_update_mtime = False
+
+    if ds_object.object_id and not ds_object.metadata.get_changed_keys():
+        logging.debug('Object %s did not change, not writing it.',
+                      ds_object.object_id)
+        return
+
+    # A synchronous write can't wait for the entry to be created
+    if asynchronous or ds_object._creating:
+        write(ds_object, update_mtime=update_mtime,
+              reply_handler=partial(__scheduled_write_reply_cb, ds_object),
+              error_handler=partial(__scheduled_write_error_cb, ds_object))
+    else:
+        try:
+            write(ds_object, update_mtime=update_mtime)
+        except dbus.DBusException:
+            logging.exception('Could not write object %s',
+                              ds_object.object_id)
+
+
+def __scheduled_write_reply_cb(ds_object, *args):
+    logging.debug('Scheduled write of object %s done.', ds_object.object_id)
+
+
+def __scheduled_write_error_cb(ds_object, error):
+    logging.error('Could not write object %s: %s', ds_object.object_id,
+                  error)
+
+
 def delete(object_id):
     """Delete the datastore entry with the given uid.
 
@@ -396,11 +1170,36 @@ def delete(object_id):
 
     """
     logging.debug('datastore.delete')
+    _unique_values.entry_changing(object_id)
+    _metadata_cache.invalidate(object_id)
     _get_data_store().delete(object_id)
 
 
+def _build_query(query, sorting, limit, offset):
+    query = query.copy()
+
+    if sorting:
+        query['order_by'] = sorting
+    if limit:
+        query['limit'] = limit
+    if offset:
+        query['offset'] = offset
+
+    return query
+
+
+def _get_find_properties(properties, with_preview):
+    if not with_preview:
+        if not properties:
+            properties = PROPERTIES_WITHOUT_PREVIEW
+        return [key for key in properties if key != 'preview']
+    elif properties is None:
+        return []
+    return properties
+
+
 def find(query, sorting=None, limit=None, offset=None, properties=None,
-         reply_handler=None, error_handler=None):
+         reply_handler=None, error_handler=None, with_preview=True):
     """Find DS entries that match the query provided.
 
     Keyword arguments:
@@ -426,26 +1225,24 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
     limit -- return only limit results (default None)
     offset -- return only results starting at offset (default None)
     properties -- you can specify here a list of metadata you want to be
-                  present in the result e.g. ['title, 'keep'] (default None)
+                  present in the result e.g. ['title, 'keep'], the other
+                  properties are fetched before the DSObjects are written
+                  (default None)
     reply_handler -- will be called with the method's return values as
                      arguments (default None)
     error_handler -- will be called with an instance of a DBusException
                      representing a remote exception (default None)
+    with_preview -- set it to False to never transfer the previews, which
+                    are the bulk of the data, DSObject.get_preview() fetches
+                    them when needed. Without properties, the well-known
+                    ones of PROPERTIES_WITHOUT_PREVIEW are returned
+                    (default True)
 
     Return: DSObjects matching the query, number of matches
 
     """
-    query = query.copy()
-
-    if properties is None:
-        properties = []
-
-    if sorting:
-        query['order_by'] = sorting
-    if limit:
-        query['limit'] = limit
-    if offset:
-        query['offset'] = offset
+    query = _build_query(query, sorting, limit, offset)
+    properties = _get_find_properties(properties, with_preview)
 
     if reply_handler and error_handler:
         _get_data_store().find(query, properties,
@@ -461,12 +1258,180 @@ def find(query, sorting=None, limit=None, offset=None, properties=None,
         object_id = entry['uid']
         del entry['uid']
 
-        ds_object = DSObject(object_id, DSMetadata(entry), None)
+        _metadata_cache.set(object_id, entry, complete=not properties)
+
+        ds_object = DSObject(object_id,
+                             DSMetadata(entry, complete=not properties),
+                             None)
         ds_objects.append(ds_object)
 
     return ds_objects, total_count
 
 
+class DSEntry(object):
+    """A read-only view of a DS entry, as yielded by iter_find().
+
+    Unlike a DSObject it does not track the updates of the entry, use
+    to_ds_object() to get one.
+    """
+
+    __slots__ = ['object_id', '_properties', '_complete']
+
+    def __init__(self, object_id, properties, complete=True):
+        self.object_id = object_id
+        self._properties = properties
+        self._complete = complete
+
+    def __getitem__(self, key):
+        return self._properties[key]
+
+    def __contains__(self, key):
+        return key in self._properties
+
+    def get(self, key, default=None):
+        return self._properties.get(key, default)
+
+    def keys(self):
+        return self._properties.keys()
+
+    def to_ds_object(self):
+        return DSObject(self.object_id,
+                        DSMetadata(self._properties.copy(), self._complete))
+
+
+def _make_entries(entries, properties):
+    ds_entries = []
+    for entry in entries:
+        object_id = entry['uid']
+        del entry['uid']
+
+        _metadata_cache.set(object_id, entry, complete=not properties)
+        ds_entries.append(DSEntry(object_id, entry, complete=not properties))
+    return ds_entries
+
+
+class _FindPages(object):
+    """Request the pages of a find() asynchronously, each page being
+    requested as soon as the previous one is received, before it is
+    handed to reply_handler.
+    """
+
+    def __init__(self, query, sorting, page_size, properties,
+                 reply_handler, error_handler):
+        self._query = query
+        self._sorting = sorting
+        self._page_size = page_size
+        self._properties = properties
+        self._reply_handler = reply_handler
+        self._error_handler = error_handler
+
+        self._offset = 0
+        self._next_offset = 0
+        self._in_flight = False
+        self._filling = False
+        self._pages = []
+        self._delivering = False
+
+    def start(self):
+        self._fill()
+
+    def _fill(self):
+        # Replies can come before the request returns, don't recurse
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while self._next_offset is not None and not self._in_flight:
+                query = _build_query(self._query, self._sorting,
+                                     self._page_size, self._next_offset)
+                self._next_offset = None
+                self._in_flight = True
+                _get_data_store().find(query, self._properties,
+                                       reply_handler=self.__reply_cb,
+                                       error_handler=self.__error_cb,
+                                       byte_arrays=True)
+        finally:
+            self._filling = False
+
+    def __reply_cb(self, entries, total_count):
+        self._in_flight = False
+        self._offset += len(entries)
+        last = not entries or self._offset >= total_count
+        if not last:
+            self._next_offset = self._offset
+            self._fill()
+
+        self._pages.append((_make_entries(entries, self._properties), last))
+        self._deliver()
+
+    def __error_cb(self, error):
+        self._in_flight = False
+        self._error_handler(error)
+
+    def _deliver(self):
+        # Keep the order of the pages if a handler leads to the next one
+        if self._delivering:
+            return
+        self._delivering = True
+        try:
+            while self._pages:
+                ds_entries, last = self._pages.pop(0)
+                self._reply_handler(ds_entries, last)
+        finally:
+            self._delivering = False
+
+
+def _iter_find_pages(query, sorting, page_size, properties):
+    offset = 0
+    while True:
+        entries, total_count = _get_data_store().find(
+            _build_query(query, sorting, page_size, offset), properties,
+            byte_arrays=True)
+        offset += len(entries)
+
+        for ds_entry in _make_entries(entries, properties):
+            yield ds_entry
+
+        if not entries or offset >= total_count:
+            break
+
+
+def iter_find(query, sorting=None, page_size=100, properties=None,
+              with_preview=True, reply_handler=None, error_handler=None):
+    """Iterate over the DS entries that match the query provided.
+
+    The entries are requested page by page, as they are consumed. When
+    the handlers are given, the pages are requested asynchronously
+    instead, the next page being requested while the current one is
+    handled.
+
+    Keyword arguments:
+    query -- a dictionary containing metadata key value pairs, see find()
+    sorting -- key to order results by e.g. 'timestamp' (default None)
+    page_size -- number of entries requested at once (default 100)
+    properties -- list of metadata to be present in the results, see find()
+                  (default None)
+    with_preview -- set it to False to never transfer the previews, see
+                    find() (default True)
+    reply_handler -- will be called with the DSEntries of each page, in
+                     order, and True for the last page (default None)
+    error_handler -- will be called with an instance of a DBusException
+                     representing a remote exception, no other page is
+                     requested then (default None)
+
+    Return: an iterator of DSEntry, None when asynchronous
+
+    """
+    properties = _get_find_properties(properties, with_preview)
+
+    if reply_handler and error_handler:
+        _FindPages(query, sorting, page_size, properties, reply_handler,
+                   error_handler).start()
+        return None
+
+    return _iter_find_pages(query, sorting, page_size, properties)
+
+
 def copy(ds_object, mount_point):
     """Copy a datastore entry
 
@@ -475,6 +1440,18 @@ def copy(ds_object, mount_point):
     mount_point -- mount point of the new datastore entry
 
     """
+    new_ds_object = _copy_ds_object(ds_object, mount_point)
+
+    # this will cause the file be retrieved from the DS
+    new_ds_object.file_path = ds_object.file_path
+
+    write(new_ds_object)
+
+
+def _copy_ds_object(ds_object, mount_point):
+    if ds_object.object_id and not ds_object.metadata.is_complete():
+        _complete_metadata(ds_object)
+
     new_ds_object = ds_object.copy()
     new_ds_object.metadata['mountpoint'] = mount_point
 
@@ -489,20 +1466,298 @@ def copy(ds_object, mount_point):
 
         new_ds_object.metadata['suggested_filename'] = filename
 
-    # this will cause the file be retrieved from the DS
-    new_ds_object.file_path = ds_object.file_path
+    return new_ds_object
 
-    write(new_ds_object)
+
+class _BulkOperation(object):
+    """Send a request per item, keeping at most max_in_flight of them
+    waiting for their reply, for the asynchronous bulk operations.
+
+    start_request is called with an item, a reply handler taking the
+    result and an error handler taking the exception.
+    """
+
+    def __init__(self, name, items, start_request, max_in_flight):
+        self._name = name
+        self._items = list(items)
+        self._start_request = start_request
+        self._max_in_flight = max(max_in_flight, 1)
+
+        self._results = [None] * len(self._items)
+        self._next = 0
+        self._in_flight = 0
+        self._done = 0
+        self._filling = False
+        self._finished = False
+        self._reply_handler = None
+        self._error_handler = None
+
+    def start(self, reply_handler, error_handler=None):
+        self._reply_handler = reply_handler
+        self._error_handler = error_handler
+        self._fill()
+
+    def _fill(self):
+        # Replies can come before the request returns, don't recurse
+        if self._filling:
+            return
+        self._filling = True
+        try:
+            while self._in_flight < self._max_in_flight and \
+                    self._next < len(self._items):
+                index = self._next
+                self._next += 1
+                self._in_flight += 1
+                try:
+                    self._start_request(self._items[index],
+                                        partial(self.__reply_cb, index),
+                                        partial(self.__error_cb, index))
+                except Exception, e:
+                    self.__error_cb(index, e)
+        finally:
+            self._filling = False
+
+        if self._done == len(self._items) and not self._finished:
+            self._finished = True
+            self._reply_handler(self._results)
+
+    def __reply_cb(self, index, result=None):
+        self._results[index] = result
+        self._complete()
+
+    def __error_cb(self, index, error):
+        item = self._items[index]
+        if self._error_handler is not None:
+            self._error_handler(item, error)
+        else:
+            logging.error('Error during bulk %s of %s: %s', self._name, item,
+                          error)
+        self._complete()
+
+    def _complete(self):
+        self._in_flight -= 1
+        self._done += 1
+        progress.send(None, operation=self._name, done=self._done,
+                      total=len(self._items))
+        self._fill()
+
+
+def _run_bulk_operation(name, items, start_request, run_request,
+                        reply_handler, error_handler, max_in_flight):
+    if reply_handler:
+        operation = _BulkOperation(name, items, start_request,
+                                   max_in_flight)
+        operation.start(reply_handler, error_handler)
+        return None
+
+    # Pipelining needs the main loop to get the replies, which would
+    # dispatch other events, so block on each request instead
+    items = list(items)
+    results = []
+    errors = []
+    for item in items:
+        try:
+            results.append(run_request(item))
+        except Exception, e:
+            results.append(None)
+            errors.append(e)
+            if error_handler is not None:
+                error_handler(item, e)
+        progress.send(None, operation=name, done=len(results),
+                      total=len(items))
+
+    if errors:
+        raise errors[0]
+    return results
+
+
+def _request_get(properties, object_id, reply_handler, error_handler):
+    if object_id.startswith('/'):
+        reply_handler(RawObject(object_id))
+        return
+
+    cached_properties = _metadata_cache.get(object_id, properties)
+    if cached_properties is not None:
+        metadata = DSMetadata(cached_properties, complete=properties is None)
+        reply_handler(DSObject(object_id, metadata))
+        return
+
+    def properties_cb(metadata):
+        _metadata_cache.set(object_id, metadata)
+        reply_handler(DSObject(object_id, DSMetadata(metadata)))
+
+    def find_cb(entries, total_count_):
+        if not entries:
+            error_handler(ValueError('No datastore entry with uid %s' %
+                                     object_id))
+            return
+        _metadata_cache.set(object_id, entries[0], complete=False)
+        reply_handler(DSObject(object_id,
+                               DSMetadata(entries[0], complete=False)))
+
+    if properties is None:
+        _get_data_store().get_properties(object_id,
+                                         reply_handler=properties_cb,
+                                         error_handler=error_handler,
+                                         byte_arrays=True)
+    else:
+        _get_data_store().find({'uid': object_id}, properties,
+                               reply_handler=find_cb,
+                               error_handler=error_handler,
+                               byte_arrays=True)
+
+
+def _request_delete(object_id, reply_handler, error_handler):
+    _unique_values.entry_changing(object_id)
+    _metadata_cache.invalidate(object_id)
+    _get_data_store().delete(object_id, reply_handler=reply_handler,
+                             error_handler=error_handler)
+
+
+def _request_copy(mount_point, ds_object, reply_handler, error_handler):
+
+    def complete_cb():
+        new_ds_object = _copy_ds_object(ds_object, mount_point)
+
+        def write_reply_cb(object_id):
+            new_ds_object.destroy()
+            reply_handler(object_id)
+
+        def write_error_cb(error):
+            new_ds_object.destroy()
+            error_handler(error)
+
+        def filename_cb(file_path=None):
+            if file_path is not None:
+                ds_object.set_file_path(file_path)
+                ds_object._owns_file = True
+            new_ds_object.file_path = ds_object.get_file_path(fetch=False)
+            write(new_ds_object, reply_handler=write_reply_cb,
+                  error_handler=write_error_cb)
+
+        if ds_object.get_file_path(fetch=False) is None and \
+                ds_object.object_id is not None:
+            _get_data_store().get_filename(ds_object.object_id,
+                                           reply_handler=filename_cb,
+                                           error_handler=write_error_cb)
+        else:
+            filename_cb()
+
+    # All the properties are copied, not only those fetched
+    _request_complete_metadata(ds_object, complete_cb, error_handler)
+
+
+def _get_many_item(properties, object_id):
+    return get(object_id, properties)
+
+
+def _copy_many_item(mount_point, ds_object):
+    new_ds_object = _copy_ds_object(ds_object, mount_point)
+    try:
+        new_ds_object.file_path = ds_object.file_path
+        write(new_ds_object)
+        return new_ds_object.object_id
+    finally:
+        new_ds_object.destroy()
+
+
+def get_many(object_ids, properties=None, reply_handler=None,
+             error_handler=None, max_in_flight=_MAX_IN_FLIGHT):
+    """Get the objects with the IDs given, see get().
+
+    When asynchronous, the requests are sent without waiting for the
+    previous replies, up to max_in_flight at once, otherwise they are
+    made one after the other. The progress signal is sent with the 'get'
+    operation as they complete.
+
+    Keyword arguments:
+    object_ids -- list of unique identifiers of the objects
+    properties -- list of the properties needed, all of them if None
+                  (default None)
+    reply_handler -- if given, the call is asynchronous and it will be
+                     called with the DSObjects, in the order of
+                     object_ids, None for those which failed (default None)
+    error_handler -- will be called with the unique identifier and the
+                     exception of each object which failed (default None)
+    max_in_flight -- number of requests waiting for their reply at most
+                     (default 8)
+
+    Return: the list of DSObjects when synchronous, the first error is
+            raised once all the requests are done
+
+    """
+    return _run_bulk_operation('get', object_ids,
+                               partial(_request_get, properties),
+                               partial(_get_many_item, properties),
+                               reply_handler, error_handler, max_in_flight)
+
+
+def delete_many(object_ids, reply_handler=None, error_handler=None,
+                max_in_flight=_MAX_IN_FLIGHT):
+    """Delete the datastore entries with the given uids.
+
+    The asynchronous requests are pipelined as in get_many(). The
+    progress signal is sent with the 'delete' operation.
+
+    Keyword arguments:
+    object_ids -- list of uids of datastore entries
+    reply_handler -- if given, the call is asynchronous and it will be
+                     called once all the entries are deleted (default None)
+    error_handler -- will be called with the uid and the exception of each
+                     entry which could not be deleted (default None)
+    max_in_flight -- number of requests waiting for their reply at most
+                     (default 8)
+
+    """
+    if reply_handler:
+        def done_cb(results_):
+            reply_handler()
+    else:
+        done_cb = None
+
+    _run_bulk_operation('delete', object_ids, _request_delete, delete,
+                        done_cb, error_handler, max_in_flight)
+
+
+def copy_many(ds_objects, mount_point, reply_handler=None,
+              error_handler=None, max_in_flight=_MAX_IN_FLIGHT):
+    """Copy datastore entries, see copy().
+
+    When asynchronous, the files are fetched and the copies are written
+    pipelined as in get_many(). The progress signal is sent with the
+    'copy' operation.
+
+    Keyword arguments:
+    ds_objects -- list of DSObjects to copy
+    mount_point -- mount point of the new datastore entries
+    reply_handler -- if given, the call is asynchronous and it will be
+                     called with the uids of the new entries, in the order
+                     of ds_objects, None for those which failed
+                     (default None)
+    error_handler -- will be called with the DSObject and the exception of
+                     each entry which could not be copied (default None)
+    max_in_flight -- number of entries being copied at most (default 8)
+
+    Return: the list of uids of the new entries when synchronous
+
+    """
+    return _run_bulk_operation('copy', ds_objects,
+                               partial(_request_copy, mount_point),
+                               partial(_copy_many_item, mount_point),
+                               reply_handler, error_handler, max_in_flight)
 
 
 def get_unique_values(key):
     """Retrieve an array of unique values for a field.
 
+    The values are cached, and maintained from the signals of the
+    datastore. They are asked to the datastore again after entries are
+    deleted.
+
     Keyword arguments:
-    key -- only the property activity is currently supported
+    key -- name of the property, e.g. 'activity'
 
-    Return: list of activities
+    Return: list of the values
 
     """
-    return _get_data_store().get_uniquevaluesfor(
-                                key, dbus.Dictionary({}, signature='ss'))
+    return _unique_values.get(key)
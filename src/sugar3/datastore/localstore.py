@@ -0,0 +1,385 @@
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+UNSTABLE
+
+An in-process datastore, backed by SQLite, to use in place of the
+DataStore service when there is none, in tests and benchmarks:
+
+    from sugar3.datastore import datastore
+    from sugar3.datastore.localstore import LocalDataStore
+
+    datastore.set_backend(LocalDataStore('/tmp/datastore'))
+
+The title, description and tags of the entries are indexed for the
+'query' full-text key. Unlike over D-Bus, the reply handlers and the
+signal handlers are called before the methods return.
+"""
+
+import os
+import uuid
+import time
+import shutil
+import logging
+import tempfile
+import sqlite3
+import cPickle
+from errno import EEXIST
+
+import dbus
+
+# Properties searched by the 'query' key
+_FULLTEXT_PROPERTIES = ['title', 'description', 'tags']
+
+# Query keys which are not properties
+_QUERY_OPTIONS = ['query', 'order_by', 'limit', 'offset', 'mountpoints']
+
+_DEFAULT_ORDER = ['-timestamp']
+
+
+def _to_python(value):
+    # The dbus types can't be pickled
+    if isinstance(value, bool):
+        return int(value)
+    elif isinstance(value, unicode):
+        return unicode(value)
+    elif isinstance(value, str):
+        return str(value)
+    elif isinstance(value, long):
+        return long(value)
+    elif isinstance(value, int):
+        return int(value)
+    elif isinstance(value, float):
+        return float(value)
+    return value
+
+
+def _to_column(value):
+    # Text and numbers are indexed, so that they can be queried and sorted
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+class LocalDataStore(object):
+    """A datastore stored in a directory, see sugar3.datastore.datastore
+    set_backend().
+
+    Keyword arguments:
+    root_path -- directory of the database and of the files of the
+                 entries, created if needed
+
+    """
+
+    def __init__(self, root_path):
+        self._root_path = root_path
+        self._files_path = os.path.join(root_path, 'files')
+        self._tmp_path = os.path.join(root_path, 'tmp')
+        for path in [self._files_path, self._tmp_path]:
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        self._handlers = {'Created': [], 'Updated': [], 'Deleted': []}
+
+        self._db = sqlite3.connect(os.path.join(root_path, 'datastore.db'))
+        self._db.text_factory = str
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                uid TEXT UNIQUE,
+                metadata BLOB);
+            CREATE TABLE IF NOT EXISTS properties (
+                uid TEXT,
+                key TEXT,
+                value);
+            CREATE INDEX IF NOT EXISTS properties_key
+                ON properties (key, value);
+            CREATE INDEX IF NOT EXISTS properties_uid
+                ON properties (uid, key);""")
+        try:
+            self._db.execute('CREATE VIRTUAL TABLE IF NOT EXISTS fulltext '
+                             'USING fts4(content)')
+            self._has_fts = True
+        except sqlite3.OperationalError:
+            logging.warning('No full-text search in SQLite, using LIKE.')
+            self._db.execute('CREATE TABLE IF NOT EXISTS fulltext '
+                             '(docid INTEGER PRIMARY KEY, content TEXT)')
+            self._has_fts = False
+        self._db.commit()
+
+    def connect_to_signal(self, signal_name, handler):
+        self._handlers[signal_name].append(handler)
+
+    def _emit(self, signal_name, object_id):
+        for handler in self._handlers[signal_name]:
+            handler(object_id)
+
+    def _call(self, method, args, reply_handler=None, error_handler=None,
+              byte_arrays=False, timeout=-1):
+        try:
+            result = method(*args)
+        except Exception, e:
+            if error_handler is None:
+                raise
+            error_handler(e)
+            return None
+
+        if reply_handler is None:
+            return result
+        if result is None:
+            reply_handler()
+        elif isinstance(result, tuple):
+            reply_handler(*result)
+        else:
+            reply_handler(result)
+        return None
+
+    def create(self, properties, file_path, transfer_ownership, **kwargs):
+        return self._call(self._create,
+                          (properties, file_path, transfer_ownership),
+                          **kwargs)
+
+    def update(self, uid, properties, file_path, transfer_ownership,
+               **kwargs):
+        return self._call(self._update,
+                          (uid, properties, file_path, transfer_ownership),
+                          **kwargs)
+
+    def delete(self, uid, **kwargs):
+        return self._call(self._delete, (uid,), **kwargs)
+
+    def find(self, query, properties, **kwargs):
+        return self._call(self._find, (query, properties), **kwargs)
+
+    def get_properties(self, uid, **kwargs):
+        return self._call(self._get_properties, (uid,), **kwargs)
+
+    def get_filename(self, uid, **kwargs):
+        return self._call(self._get_filename, (uid,), **kwargs)
+
+    def get_uniquevaluesfor(self, key, query, **kwargs):
+        return self._call(self._get_unique_values, (key,), **kwargs)
+
+    def _create(self, properties, file_path, transfer_ownership):
+        uid = str(uuid.uuid4())
+        properties = self._prepare_properties(uid, properties)
+        properties.setdefault('timestamp', int(time.time()))
+        properties['creation_time'] = time.time()
+
+        self._store_file(uid, properties, file_path, transfer_ownership)
+        cursor = self._db.execute('INSERT INTO entries (uid) VALUES (?)',
+                                  (uid,))
+        self._store_properties(cursor.lastrowid, uid, properties)
+        self._db.commit()
+
+        self._emit('Created', uid)
+        return uid
+
+    def _update(self, uid, properties, file_path, transfer_ownership):
+        entry_id = self._get_entry_id(uid)
+        previous = self._get_properties(uid)
+
+        properties = self._prepare_properties(uid, properties)
+        properties.setdefault('creation_time',
+                              previous.get('creation_time', time.time()))
+        if file_path:
+            self._store_file(uid, properties, file_path, transfer_ownership)
+        elif 'filesize' in previous:
+            properties['filesize'] = previous['filesize']
+
+        self._db.execute('DELETE FROM properties WHERE uid = ?', (uid,))
+        self._db.execute('DELETE FROM fulltext WHERE docid = ?', (entry_id,))
+        self._store_properties(entry_id, uid, properties)
+        self._db.commit()
+
+        self._emit('Updated', uid)
+
+    def _delete(self, uid):
+        entry_id = self._get_entry_id(uid)
+        self._db.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
+        self._db.execute('DELETE FROM properties WHERE uid = ?', (uid,))
+        self._db.execute('DELETE FROM fulltext WHERE docid = ?', (entry_id,))
+        self._db.commit()
+
+        data_path = os.path.join(self._files_path, uid)
+        if os.path.exists(data_path):
+            os.remove(data_path)
+
+        self._emit('Deleted', uid)
+
+    def _find(self, query, properties):
+        conditions, parameters = self._build_conditions(query)
+        where = ''
+        if conditions:
+            where = ' WHERE ' + ' AND '.join(conditions)
+
+        total_count = self._db.execute('SELECT COUNT(*) FROM entries e' +
+                                       where, parameters).fetchone()[0]
+
+        joins = []
+        order = []
+        order_parameters = []
+        order_by = query.get('order_by') or _DEFAULT_ORDER
+        if isinstance(order_by, basestring):
+            order_by = [order_by]
+        for i, key in enumerate(order_by):
+            direction = 'DESC' if key.startswith('-') else 'ASC'
+            joins.append('LEFT JOIN properties o%d ON o%d.uid = e.uid '
+                         'AND o%d.key = ?' % (i, i, i))
+            order_parameters.append(key.lstrip('+-'))
+            order.append('o%d.value %s' % (i, direction))
+
+        statement = 'SELECT e.uid, e.metadata FROM entries e %s%s ' \
+                    'ORDER BY %s' % (' '.join(joins), where,
+                                     ', '.join(order + ['e.id']))
+        parameters = order_parameters + parameters
+        if query.get('limit'):
+            statement += ' LIMIT ? OFFSET ?'
+            parameters += [int(query['limit']), int(query.get('offset', 0))]
+        elif query.get('offset'):
+            statement += ' LIMIT -1 OFFSET ?'
+            parameters.append(int(query['offset']))
+
+        entries = []
+        for uid, metadata in self._db.execute(statement, parameters):
+            entry = cPickle.loads(str(metadata))
+            if properties:
+                entry = dict([(key, entry[key]) for key in properties
+                              if key in entry])
+                entry['uid'] = uid
+            entries.append(entry)
+
+        return entries, total_count
+
+    def _build_conditions(self, query):
+        conditions = []
+        parameters = []
+        for key, value in query.items():
+            if key in _QUERY_OPTIONS and key != 'query':
+                continue
+
+            if key == 'query':
+                if not value:
+                    continue
+                if self._has_fts:
+                    conditions.append('e.id IN (SELECT docid FROM fulltext '
+                                      'WHERE fulltext MATCH ?)')
+                    parameters.append(_to_column(value))
+                else:
+                    conditions.append('e.id IN (SELECT docid FROM fulltext '
+                                      'WHERE content LIKE ?)')
+                    parameters.append('%%%s%%' % _to_column(value).rstrip('*'))
+            elif isinstance(value, dict):
+                condition = 'e.uid IN (SELECT uid FROM properties ' \
+                            'WHERE key = ?'
+                parameters.append(key)
+                if 'start' in value:
+                    condition += ' AND value >= ?'
+                    parameters.append(_to_column(value['start']))
+                if 'end' in value:
+                    condition += ' AND value <= ?'
+                    parameters.append(_to_column(value['end']))
+                conditions.append(condition + ')')
+            else:
+                if not isinstance(value, (list, tuple)):
+                    value = [value]
+                marks = ', '.join(['?'] * len(value))
+                if key == 'uid':
+                    conditions.append('e.uid IN (%s)' % marks)
+                else:
+                    conditions.append('e.uid IN (SELECT uid FROM properties '
+                                      'WHERE key = ? AND value IN (%s))' %
+                                      marks)
+                    parameters.append(key)
+                parameters.extend([_to_column(_to_python(v)) for v in value])
+
+        return conditions, parameters
+
+    def _get_properties(self, uid):
+        row = self._db.execute('SELECT metadata FROM entries WHERE uid = ?',
+                               (uid,)).fetchone()
+        if row is None:
+            raise dbus.DBusException('No entry with uid %s' % uid)
+        return cPickle.loads(str(row[0]))
+
+    def _get_filename(self, uid):
+        self._get_entry_id(uid)
+        data_path = os.path.join(self._files_path, uid)
+        if not os.path.exists(data_path):
+            return ''
+
+        # The caller owns the file returned, give it its own link
+        while True:
+            file_path = tempfile.mktemp(prefix=uid, dir=self._tmp_path)
+            try:
+                os.link(data_path, file_path)
+                return file_path
+            except OSError, e:
+                if e.errno != EEXIST:
+                    raise
+
+    def _get_unique_values(self, key):
+        rows = self._db.execute('SELECT DISTINCT value FROM properties '
+                                'WHERE key = ?', (key,))
+        return [row[0] for row in rows]
+
+    def _get_entry_id(self, uid):
+        row = self._db.execute('SELECT id FROM entries WHERE uid = ?',
+                               (uid,)).fetchone()
+        if row is None:
+            raise dbus.DBusException('No entry with uid %s' % uid)
+        return row[0]
+
+    def _prepare_properties(self, uid, properties):
+        properties = dict([(str(key), _to_python(value))
+                           for key, value in properties.items()])
+        properties['uid'] = uid
+        return properties
+
+    def _store_file(self, uid, properties, file_path, transfer_ownership):
+        if not file_path:
+            return
+
+        data_path = os.path.join(self._files_path, uid)
+        if transfer_ownership:
+            try:
+                os.rename(file_path, data_path)
+            except OSError:
+                shutil.copyfile(file_path, data_path)
+                os.remove(file_path)
+        else:
+            shutil.copyfile(file_path, data_path)
+        properties['filesize'] = os.stat(data_path).st_size
+
+    def _store_properties(self, entry_id, uid, properties):
+        self._db.execute('UPDATE entries SET metadata = ? WHERE id = ?',
+                         (sqlite3.Binary(cPickle.dumps(properties, 2)),
+                          entry_id))
+        self._db.executemany(
+            'INSERT INTO properties (uid, key, value) VALUES (?, ?, ?)',
+            [(uid, key, _to_column(value))
+             for key, value in properties.items()
+             if key not in ['uid', 'preview']])
+
+        text = ' '.join([_to_column(properties[key])
+                         for key in _FULLTEXT_PROPERTIES
+                         if isinstance(properties.get(key), basestring)])
+        self._db.execute('INSERT INTO fulltext (docid, content) '
+                         'VALUES (?, ?)', (entry_id, text))
@@ -21,9 +21,19 @@ A small fixed size picture, typically used to decorate components.
 STABLE.
 """
 
+import os
 import re
+import copy
 import math
+import mmap
+import struct
+import hashlib
 import logging
+import operator
+import time
+import tempfile
+import threading
+import Queue
 
 from gi.repository import GObject
 from gi.repository import Gtk
@@ -32,38 +42,558 @@ from gi.repository import GdkPixbuf
 from gi.repository import Rsvg
 import cairo
 
+from sugar3 import env
 from sugar3.graphics import style
 from sugar3.graphics.xocolor import XoColor
-from sugar3.util import LRU
+from sugar3.util import SizedLRU
 
 _BADGE_SIZE = 0.45
+_INSENSITIVE_SATURATION = 0.2
+_INSENSITIVE_ALPHA = 0.5
+_ATLAS_COLUMNS = 8
+_ATLAS_ROWS = 8
+
+
+def _compute_cache_size():
+    try:
+        return int(os.environ.get('SUGAR_ICON_CACHE_SIZE', '8192')) * 1024
+    except ValueError:
+        logging.error('Invalid SUGAR_ICON_CACHE_SIZE.')
+
+    return 8192 * 1024
+
+
+# Byte budgets of the icon caches, the one of the rendered surfaces can be
+# set in KiB with the SUGAR_ICON_CACHE_SIZE environment variable
+_SURFACE_CACHE_SIZE = _compute_cache_size()
+_SVG_CACHE_SIZE = 1024 * 1024
+
+# Byte budget of the rendered surfaces kept on disk, and seconds after
+# which the temporary files of unfinished writes are removed
+_DISK_CACHE_SIZE = 32 * 1024 * 1024
+_DISK_CACHE_TEMP_AGE = 60 * 60
+
+# Seconds before an icon which could not be rendered is tried again
+_RENDER_RETRY_DELAY = 60
+
+
+def _get_surface_size(surface):
+    return surface.get_stride() * surface.get_height()
+
+
+class _SVGTemplate(object):
+    """An icon file split at its entity declarations.
+
+    Recoloring the icon is then a join of the pieces instead of a regular
+    expression substitution over the whole file for every entity.
+    """
+
+    _ENTITY_RE = re.compile(r'<!ENTITY (\w+) [^>]*>')
+
+    def __init__(self, data):
+        self._pieces = []
+        self._declarations = []
+
+        position = 0
+        for match in self._ENTITY_RE.finditer(data):
+            self._pieces.append(data[position:match.start()])
+            self._declarations.append((match.group(1), match.group(0)))
+            position = match.end()
+        self._pieces.append(data[position:])
+
+    def substitute(self, entities):
+        parts = []
+        for piece, (entity, xml) in zip(self._pieces, self._declarations):
+            parts.append(piece)
+            if entity in entities:
+                xml = '<!ENTITY %s "%s">' % (entity, entities[entity])
+            parts.append(xml)
+        parts.append(self._pieces[-1])
+
+        return ''.join(parts)
+
+    def __len__(self):
+        return sum(len(piece) for piece in self._pieces) + \
+            sum(len(xml) for entity_, xml in self._declarations)
 
 
 class _SVGLoader(object):
 
     def __init__(self):
-        self._cache = LRU(50)
+        self._lock = threading.Lock()
+        self._cache = SizedLRU(_SVG_CACHE_SIZE)
+        # The size of a handle is estimated from the size of its document
+        self._handle_cache = SizedLRU(_SVG_CACHE_SIZE, operator.itemgetter(1))
 
     def load(self, file_name, entities, cache):
-        if file_name in self._cache:
-            icon = self._cache[file_name]
-        else:
+        # Icons can be loaded from the render workers too, only the caches
+        # are locked so that a worker parsing a big icon doesn't hold up
+        # the main loop
+        valid_entities = {}
+        for entity, value in entities.items():
+            if isinstance(value, basestring):
+                valid_entities[entity] = value
+            else:
+                logging.error(
+                    'Icon %s, entity %s is invalid.', file_name, entity)
+
+        handle_key = (file_name, tuple(sorted(valid_entities.items())))
+        if cache:
+            with self._lock:
+                entry = self._handle_cache.get(handle_key)
+            if entry is not None:
+                return entry[0]
+
+        with self._lock:
+            template = self._cache.get(file_name)
+        if template is None:
             icon_file = open(file_name, 'r')
-            icon = icon_file.read()
+            template = _SVGTemplate(icon_file.read())
             icon_file.close()
 
             if cache:
-                self._cache[file_name] = icon
+                with self._lock:
+                    self._cache[file_name] = template
 
-        for entity, value in entities.items():
-            if isinstance(value, basestring):
-                xml = '<!ENTITY %s "%s">' % (entity, value)
-                icon = re.sub('<!ENTITY %s .*>' % entity, xml, icon)
+        data = template.substitute(valid_entities)
+        handle = Rsvg.Handle.new_from_data(data)
+        if cache:
+            with self._lock:
+                self._handle_cache[handle_key] = (handle, len(data))
+
+        return handle
+
+
+class _SurfaceDiskCache(object):
+    """Rendered surfaces kept on disk, shared by all the processes.
+
+    Each file holds the raw surface data followed by a small trailer
+    describing it, so it can be mapped straight into a cairo surface
+    without rendering the icon again. The trailer holds the mtime of the
+    icon file too, a file rendered from an older version of the icon is
+    replaced by the new one instead of being kept next to it.
+
+    The files are written from an idle callback, and the least recently
+    used ones are removed once the cache is above its byte budget. The
+    files loaded are marked as used from the idle callback too, a batch
+    at a time.
+    """
+
+    _MAGIC = 'SIC2'
+    _TRAILER = struct.Struct('<4siiiid')
+    _TEMP_PREFIX = '.tmp'
+
+    def __init__(self, path, max_size=_DISK_CACHE_SIZE):
+        self._path = path
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._used = set()
+        self._idle_sid = None
+
+        GObject.idle_add(self.prune, priority=GObject.PRIORITY_LOW)
+
+    def _get_path(self, key):
+        return os.path.join(self._path, hashlib.sha1(repr(key)).hexdigest())
+
+    def load(self, key, source_mtime):
+        path = self._get_path(key)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+
+        try:
+            size = os.fstat(fd).st_size - self._TRAILER.size
+            if size <= 0:
+                return None
+
+            os.lseek(fd, size, os.SEEK_SET)
+            trailer = os.read(fd, self._TRAILER.size)
+            magic, surface_format, width, height, stride, mtime = \
+                self._TRAILER.unpack(trailer)
+            if magic != self._MAGIC or stride * height != size or \
+                    mtime != source_mtime:
+                return None
+
+            # A private mapping, the surface can't modify the cached file
+            data = mmap.mmap(fd, size, access=mmap.ACCESS_COPY)
+        except (OSError, struct.error, mmap.error):
+            logging.exception('Error reading icon cache')
+            return None
+        finally:
+            os.close(fd)
+
+        # Mark it as used, atimes are not reliable, see prune()
+        with self._lock:
+            self._used.add(path)
+            self._schedule()
+
+        return cairo.ImageSurface.create_for_data(data, surface_format,
+                                                  width, height, stride)
+
+    def store(self, key, source_mtime, surface):
+        """Write the surface from an idle callback, so that drawing an
+        icon for the first time does not wait for the disk."""
+        with self._lock:
+            self._pending.append((key, source_mtime, surface))
+            self._schedule()
+
+    def _schedule(self):
+        if self._idle_sid is None:
+            self._idle_sid = GObject.idle_add(self.__idle_cb,
+                                              priority=GObject.PRIORITY_LOW)
+
+    def __idle_cb(self):
+        with self._lock:
+            used = self._used
+            self._used = set()
+            pending = None
+            if self._pending:
+                pending = self._pending.pop(0)
+            if not self._pending:
+                self._idle_sid = None
+
+        for path in used:
+            try:
+                os.utime(path, None)
+            except OSError:
+                # Removed by another process meanwhile
+                pass
+
+        if pending is not None:
+            key, source_mtime, surface = pending
+            self.write(key, source_mtime, surface)
+        return self._idle_sid is not None
+
+    def write(self, key, source_mtime, surface):
+        """Write the surface right away, see store()."""
+        surface.flush()
+        trailer = self._TRAILER.pack(self._MAGIC, surface.get_format(),
+                                     surface.get_width(),
+                                     surface.get_height(),
+                                     surface.get_stride(), source_mtime)
+        temp_path = None
+        try:
+            if not os.path.isdir(self._path):
+                os.makedirs(self._path)
+
+            fd, temp_path = tempfile.mkstemp(dir=self._path,
+                                             prefix=self._TEMP_PREFIX)
+            with os.fdopen(fd, 'wb') as cache_file:
+                cache_file.write(surface.get_data())
+                cache_file.write(trailer)
+
+            # Readers mapping the old file keep it, so replace it atomically
+            os.rename(temp_path, self._get_path(key))
+        except (IOError, OSError):
+            logging.exception('Error writing icon cache')
+            if temp_path is not None and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    def prune(self):
+        """Remove the least recently used files beyond the byte budget.
+
+        The files are ordered by mtime, which load() updates, as the
+        atime is often not maintained. Temporary files left behind by
+        processes which did not finish writing are removed as well.
+        """
+        try:
+            names = os.listdir(self._path)
+        except OSError:
+            return False
+
+        entries = []
+        total_size = 0
+        for name in names:
+            path = os.path.join(self._path, name)
+            try:
+                stat = os.stat(path)
+                if name.startswith(self._TEMP_PREFIX):
+                    if stat.st_mtime < time.time() - _DISK_CACHE_TEMP_AGE:
+                        os.unlink(path)
+                    continue
+            except OSError:
+                # Removed by another process meanwhile
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        entries.sort()
+        for mtime_, size, path in entries:
+            if total_size <= self._max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total_size -= size
+
+        return False
+
+
+class _IconLookup(object):
+    """Memoized icon theme lookups.
+
+    The file name and attach points of each (icon name, size) looked up
+    are kept until the theme emits its changed signal.
+    """
+
+    def __init__(self):
+        self._theme = None
+        self._changed_hid = None
+        self._icons = {}
+        self._has_icon = {}
+
+    def _get_theme(self):
+        theme = Gtk.IconTheme.get_default()
+        if theme is not self._theme:
+            if self._theme is not None:
+                self._theme.disconnect(self._changed_hid)
+            self._theme = theme
+            self._changed_hid = theme.connect('changed',
+                                              self.__theme_changed_cb)
+            self._clear()
+
+        return theme
+
+    def _clear(self):
+        self._icons.clear()
+        self._has_icon.clear()
+
+    def __theme_changed_cb(self, theme):
+        self._clear()
+
+    def lookup(self, icon_name, size):
+        """Return (file_name, attach_x, attach_y), or None if not found.
+
+        The attach points are relative to the size.
+        """
+        size = int(size)
+        theme = self._get_theme()
+
+        key = (icon_name, size)
+        if key in self._icons:
+            return self._icons[key]
+
+        info = theme.lookup_icon(icon_name, size, 0)
+        if info:
+            has_attach_points_, attach_points = info.get_attach_points()
+            if attach_points and size:
+                attach_x = float(attach_points[0].x) / size
+                attach_y = float(attach_points[0].y) / size
             else:
-                logging.error(
-                    'Icon %s, entity %s is invalid.', file_name, entity)
+                attach_x = attach_y = 0
+
+            result = (info.get_filename(), attach_x, attach_y)
+            del info
+        else:
+            result = None
+
+        self._icons[key] = result
+        return result
+
+    def has_icon(self, icon_name):
+        theme = self._get_theme()
+
+        if icon_name not in self._has_icon:
+            self._has_icon[icon_name] = theme.has_icon(icon_name)
+        return self._has_icon[icon_name]
+
+
+_icon_lookup = _IconLookup()
+
+
+class _RenderPool(object):
+    """Worker threads rendering icons outside of the main loop.
+
+    The rendered surfaces are added to the surface cache from the main
+    loop, and the callbacks waiting for them are called there. Icons which
+    could not be rendered are not tried again for a while.
+    """
+
+    def __init__(self, n_workers=2):
+        self._queue = Queue.Queue()
+        self._pending = {}
+        # Time of the failure of the icons which could not be rendered
+        self._failed = {}
+
+        for i_ in range(n_workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def render(self, icon, cache_key, icon_info, disk_cache_key, callback):
+        failure_time = self._failed.get(cache_key)
+        if failure_time is not None:
+            if time.time() - failure_time < _RENDER_RETRY_DELAY:
+                return
+            del self._failed[cache_key]
+
+        if cache_key in self._pending:
+            self._pending[cache_key].append(callback)
+            return
+
+        self._pending[cache_key] = [callback]
+        self._queue.put((icon, cache_key, icon_info, disk_cache_key))
+
+    def _work(self):
+        while True:
+            icon, cache_key, icon_info, disk_cache_key = self._queue.get()
+            try:
+                surface = icon._render_surface(icon_info)
+                if disk_cache_key is not None:
+                    # Not in the main loop already
+                    key, source_mtime = disk_cache_key
+                    _get_disk_cache().write(key, source_mtime, surface)
+            except Exception:
+                logging.exception('Error rendering icon %s',
+                                  icon_info.file_name)
+                surface = None
+            GObject.idle_add(self.__rendered_cb, cache_key, surface)
+
+    def __rendered_cb(self, cache_key, surface):
+        if surface is None:
+            # A corrupt or removed file, it would fail again until fixed
+            self._failed[cache_key] = time.time()
+        else:
+            _IconBuffer._surface_cache[cache_key] = surface
+
+        for callback in self._pending.pop(cache_key):
+            callback(surface)
+        return False
+
+
+_render_pool = None
+_disk_cache = None
+
+
+def _get_disk_cache():
+    global _disk_cache
+
+    # Not at import time, tools which never draw don't need the profile
+    if _disk_cache is None:
+        _disk_cache = _SurfaceDiskCache(env.get_profile_path('icon-cache'))
+    return _disk_cache
+
+
+def _get_render_pool():
+    global _render_pool
+
+    if _render_pool is None:
+        # Without it the workers only run when the main loop is in Python
+        GObject.threads_init()
+        _render_pool = _RenderPool()
+    return _render_pool
+
+
+class _AtlasPage(object):
+    """The grid of slots of an atlas page, its surface is in the cache."""
+
+    def __init__(self, cache_key, width, height, max_size):
+        self.cache_key = cache_key
+        self.width = width
+        self.height = height
+
+        # A page must leave room for the other surfaces of the cache
+        side = int(math.sqrt(max_size / 4 / max(width * height * 4, 1)))
+        self.columns = max(1, min(_ATLAS_COLUMNS, side))
+        self.rows = max(1, min(_ATLAS_ROWS, side))
+        self.count = 0
+
+    def is_full(self):
+        return self.count == self.columns * self.rows
+
+    def allocate(self):
+        index = self.count
+        self.count += 1
+        return ((index % self.columns) * self.width,
+                (index / self.columns) * self.height)
+
+
+class _SurfaceAtlas(object):
+    """Surfaces of the same size and format packed in shared pages.
+
+    Each page is a grid of slots in one big surface, so drawing many small
+    icons paints sub-rectangles of a few surfaces. The pages are kept in
+    the surface cache, so they count against its byte budget and the
+    least recently used are dropped with the other surfaces, the slots of
+    a dropped page are forgotten when next looked up, or when a page is
+    added at the latest.
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._pages = {}
+        self._slots = {}
+        # The keys of the slots of each page
+        self._page_slots = {}
+        self._page_count = 0
+
+    def get(self, key):
+        """Return (surface, x, y, width, height) of key's slot, or None."""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+
+        page_key, x, y, width, height = slot
+        surface = self._cache.get(page_key)
+        if surface is None:
+            # The page was dropped from the cache
+            del self._slots[key]
+            return None
+
+        return surface, x, y, width, height
+
+    def allocate(self, key, width, height, surface_format):
+        """Reserve a slot for key.
+
+        Return: a context to draw in the slot, with its origin at the top
+                left corner of the slot and clipped to it
 
-        return Rsvg.Handle.new_from_data(icon)
+        """
+        page = self._pages.get((width, height, surface_format))
+        if page is None or page.is_full() or page.cache_key not in self._cache:
+            self._page_count += 1
+            page = _AtlasPage(('atlas-page', self._page_count), width,
+                              height, self._cache.max_size)
+            self._cache[page.cache_key] = cairo.ImageSurface(
+                surface_format, width * page.columns, height * page.rows)
+            self._pages[(width, height, surface_format)] = page
+            self._page_slots[page.cache_key] = []
+            self._prune()
+
+        x, y = page.allocate()
+        self._slots[key] = (page.cache_key, x, y, width, height)
+        self._page_slots[page.cache_key].append(key)
+
+        context = cairo.Context(self._cache[page.cache_key])
+        context.translate(x, y)
+        context.rectangle(0, 0, width, height)
+        context.clip()
+        return context
+
+    def _prune(self):
+        # Forget the slots of the pages dropped from the cache
+        for page_key, keys in self._page_slots.items():
+            if page_key in self._cache:
+                continue
+            for key in keys:
+                # Unless it was given a slot in another page since
+                slot = self._slots.get(key)
+                if slot is not None and slot[0] == page_key:
+                    del self._slots[key]
+            del self._page_slots[page_key]
+
+    def add(self, key, surface):
+        """Copy surface into a new slot for key, see get()."""
+        context = self.allocate(key, surface.get_width(),
+                                surface.get_height(), surface.get_format())
+        context.set_operator(cairo.OPERATOR_SOURCE)
+        context.set_source_surface(surface, 0, 0)
+        context.paint()
+        return self.get(key)
 
 
 class _IconInfo(object):
@@ -85,7 +615,7 @@ class _BadgeInfo(object):
 
 class _IconBuffer(object):
 
-    _surface_cache = LRU(50)
+    _surface_cache = SizedLRU(_SURFACE_CACHE_SIZE, _get_surface_size)
     _loader = _SVGLoader()
 
     def __init__(self):
@@ -109,7 +639,19 @@ class _IconBuffer(object):
                      self.background_color.blue)
         return (self.icon_name, self.file_name, self.fill_color,
                 self.stroke_color, self.badge_name, self.width, self.height,
-                color, sensitive)
+                self.scale, color, sensitive)
+
+    def _get_disk_cache_key(self, cache_key, icon_info):
+        try:
+            mtime = os.stat(icon_info.file_name).st_mtime
+        except OSError:
+            return None
+
+        # The sizes in the key are in pixels, so the surfaces can be shared
+        # by all the zoom factors. The mtime is checked on load, it is not
+        # part of the key so that a new version of the icon replaces the
+        # surface of the old one.
+        return cache_key + (icon_info.file_name,), mtime
 
     def _load_svg(self, file_name):
         entities = {}
@@ -120,49 +662,30 @@ class _IconBuffer(object):
 
         return self._loader.load(file_name, entities, self.cache)
 
-    def _get_attach_points(self, info, size_request):
-        has_attach_points_, attach_points = info.get_attach_points()
-
-        if attach_points:
-            attach_x = float(attach_points[0].x) / size_request
-            attach_y = float(attach_points[0].y) / size_request
-        else:
-            attach_x = attach_y = 0
-
-        return attach_x, attach_y
-
     def _get_icon_info(self):
         icon_info = _IconInfo()
 
         if self.file_name:
             icon_info.file_name = self.file_name
         elif self.icon_name:
-            theme = Gtk.IconTheme.get_default()
-
             size = 50
             if self.width != None:
                 size = self.width
 
-            info = theme.lookup_icon(self.icon_name, int(size), 0)
+            info = _icon_lookup.lookup(self.icon_name, size)
             if info:
-                attach_x, attach_y = self._get_attach_points(info, size)
-
-                icon_info.file_name = info.get_filename()
-                icon_info.attach_x = attach_x
-                icon_info.attach_y = attach_y
-
-                del info
+                icon_info.file_name, icon_info.attach_x, \
+                    icon_info.attach_y = info
             else:
                 logging.warning('No icon with the name %s was found in the '
                     'theme.', self.icon_name)
 
         return icon_info
 
-    def _draw_badge(self, context, size, sensitive, widget):
-        theme = Gtk.IconTheme.get_default()
-        badge_info = theme.lookup_icon(self.badge_name, int(size), 0)
+    def _draw_badge(self, context, size):
+        badge_info = _icon_lookup.lookup(self.badge_name, size)
         if badge_info:
-            badge_file_name = badge_info.get_filename()
+            badge_file_name = badge_info[0]
             if badge_file_name.endswith('.svg'):
                 handle = self._loader.load(badge_file_name, {}, self.cache)
 
@@ -179,8 +702,6 @@ class _IconBuffer(object):
             context.scale(float(size) / icon_width,
                           float(size) / icon_height)
 
-            if not sensitive:
-                pixbuf = self._get_insensitive_pixbuf(pixbuf, widget)
             Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
             context.paint()
 
@@ -192,7 +713,7 @@ class _IconBuffer(object):
             width = icon_width + padding
             height = icon_height + padding
 
-        return width, height
+        return width * self.scale, height * self.scale
 
     def _get_badge_info(self, icon_info, icon_width, icon_height):
         info = _BadgeInfo()
@@ -227,34 +748,119 @@ class _IconBuffer(object):
             self.stroke_color = None
             self.fill_color = None
 
-    def _get_insensitive_pixbuf(self, pixbuf, widget):
-        if not (widget and widget.get_style()):
-            return pixbuf
+    def _render_insensitive_surface(self, icon_info):
+        # Derived from the transparent sensitive surface, which is cached
+        # too, so toggling the sensitivity never renders the icon again
+        icon = copy.copy(self)
+        icon.background_color = None
+        source = icon.get_surface(True, icon_info=icon_info)
+
+        if self.background_color is None:
+            surface_format = cairo.FORMAT_ARGB32
+        else:
+            surface_format = cairo.FORMAT_RGB24
+        surface = cairo.ImageSurface(surface_format, source.get_width(),
+                                     source.get_height())
+        context = cairo.Context(surface)
+        if self.background_color is not None:
+            context.set_source_color(self.background_color)
+            context.paint()
+
+        # Both passes are done by cairo over the whole pixel buffer
+        context.push_group()
+        context.set_source_surface(source, 0, 0)
+        context.paint()
+        context.set_operator(cairo.OPERATOR_HSL_SATURATION)
+        context.set_source_rgba(0.5, 0.5, 0.5, 1 - _INSENSITIVE_SATURATION)
+        context.mask_surface(source, 0, 0)
+        context.pop_group_to_source()
+        context.paint_with_alpha(_INSENSITIVE_ALPHA)
+
+        return surface
+
+    def _get_stored_surface(self, cache_key, icon_info):
+        # Only share theme icons, files are often temporary (previews...)
+        if not self.icon_name:
+            return None, None
+
+        disk_cache_key = self._get_disk_cache_key(cache_key, icon_info)
+        if disk_cache_key is None:
+            return None, None
+
+        key, source_mtime = disk_cache_key
+        return _get_disk_cache().load(key, source_mtime), disk_cache_key
+
+    def get_surface(self, sensitive=True, widget=None, icon_info=None):
+        cache_key = self._get_cache_key(sensitive)
+        surface = self._surface_cache.get(cache_key)
+        if surface is not None:
+            return surface
+
+        if icon_info is None:
+            icon_info = self._get_icon_info()
+        if icon_info.file_name is None:
+            return None
+
+        surface, disk_cache_key = self._get_stored_surface(cache_key,
+                                                           icon_info)
+        if surface is None:
+            if sensitive:
+                surface = self._render_surface(icon_info)
+            else:
+                surface = self._render_insensitive_surface(icon_info)
+            if disk_cache_key is not None:
+                key, source_mtime = disk_cache_key
+                _get_disk_cache().store(key, source_mtime, surface)
 
-        icon_source = Gtk.IconSource()
-        # Special size meaning "don't touch"
-        icon_source.set_size(-1)
-        icon_source.set_pixbuf(pixbuf)
-        icon_source.set_state(Gtk.StateType.INSENSITIVE)
-        icon_source.set_direction_wildcarded(False)
-        icon_source.set_size_wildcarded(False)
+        self._surface_cache[cache_key] = surface
+        return surface
 
-        style = widget.get_style()
-        pixbuf = style.render_icon(icon_source, widget.get_direction(),
-                                   Gtk.StateType.INSENSITIVE, -1, widget,
-                                   'sugar-icon')
+    def get_surface_async(self, callback, sensitive=True, widget=None):
+        """Like get_surface() but render the icon in a worker thread.
 
-        return pixbuf
+        Return the surface if it is cached, otherwise return None and
+        call callback from the main loop once it has been rendered, with
+        None if it could not be. Icons which could not be rendered recently
+        are not tried again and callback is not called for them.
+        Icons with a badge need the main loop to be rendered and
+        insensitive icons are derived from the sensitive ones, they are
+        rendered right away.
+        """
+        if self.badge_name or not sensitive:
+            return self.get_surface(sensitive, widget)
 
-    def get_surface(self, sensitive=True, widget=None):
         cache_key = self._get_cache_key(sensitive)
-        if cache_key in self._surface_cache:
-            return self._surface_cache[cache_key]
+        surface = self._surface_cache.get(cache_key)
+        if surface is not None:
+            return surface
 
         icon_info = self._get_icon_info()
         if icon_info.file_name is None:
             return None
 
+        surface, disk_cache_key = self._get_stored_surface(cache_key,
+                                                           icon_info)
+        if surface is not None:
+            self._surface_cache[cache_key] = surface
+            return surface
+
+        # The worker must not share the Rsvg handles with the main loop
+        icon = copy.copy(self)
+        icon.cache = False
+        _get_render_pool().render(icon, cache_key, icon_info,
+                                  disk_cache_key, callback)
+        return None
+
+    def _render_surface(self, icon_info):
+        width, height, surface_format, draw = self._prepare_render(icon_info)
+        surface = cairo.ImageSurface(surface_format, width, height)
+        draw(cairo.Context(surface))
+        return surface
+
+    def _prepare_render(self, icon_info):
+        # Return the width, height and format of the surface of the icon,
+        # and a function drawing it with a context whose origin is the top
+        # left corner of the surface, see get_atlas_slot()
         is_svg = icon_info.file_name.endswith('.svg')
 
         if is_svg:
@@ -271,44 +877,62 @@ class _IconBuffer(object):
         padding = badge_info.icon_padding
         width, height = self._get_size(icon_width, icon_height, padding)
         if self.background_color is None:
-            surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, int(width),
-                                         int(height))
-            context = cairo.Context(surface)
+            surface_format = cairo.FORMAT_ARGB32
         else:
-            surface = cairo.ImageSurface(cairo.FORMAT_RGB24, int(width),
-                                         int(height))
-            context = cairo.Context(surface)
-            context.set_source_color(self.background_color)
-            context.paint()
+            surface_format = cairo.FORMAT_RGB24
 
-        context.scale(float(width) / (icon_width + padding * 2),
-                      float(height) / (icon_height + padding * 2))
-        context.save()
+        def draw(context):
+            if self.background_color is not None:
+                context.set_source_color(self.background_color)
+                context.paint()
 
-        context.translate(padding, padding)
-        if is_svg:
-            if sensitive:
+            context.scale(float(width) / (icon_width + padding * 2),
+                          float(height) / (icon_height + padding * 2))
+            context.save()
+
+            context.translate(padding, padding)
+            if is_svg:
                 handle.render_cairo(context)
             else:
-                pixbuf = handle.get_pixbuf()
-                pixbuf = self._get_insensitive_pixbuf(pixbuf, widget)
-
                 Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
                 context.paint()
-        else:
-            if not sensitive:
-                pixbuf = self._get_insensitive_pixbuf(pixbuf, widget)
-            Gdk.cairo_set_source_pixbuf(context, pixbuf, 0, 0)
-            context.paint()
 
-        if self.badge_name:
-            context.restore()
-            context.translate(badge_info.attach_x, badge_info.attach_y)
-            self._draw_badge(context, badge_info.size, sensitive, widget)
+            if self.badge_name:
+                context.restore()
+                context.translate(badge_info.attach_x, badge_info.attach_y)
+                self._draw_badge(context, badge_info.size)
 
-        self._surface_cache[cache_key] = surface
+        return int(width), int(height), surface_format, draw
 
-        return surface
+    def get_atlas_slot(self, atlas):
+        """Get the slot of the sensitive icon in atlas, adding it if needed.
+
+        An icon already rendered is copied into the slot, else it is
+        rendered straight into it, without a surface of its own kept in
+        the surface cache.
+
+        Return: (surface, x, y, width, height) of the slot, or None if the
+                icon was not found
+
+        """
+        cache_key = self._get_cache_key(True)
+        slot = atlas.get(cache_key)
+        if slot is not None:
+            return slot
+
+        surface = self._surface_cache.get(cache_key)
+        if surface is None:
+            icon_info = self._get_icon_info()
+            if icon_info.file_name is None:
+                return None
+            surface, disk_cache_key_ = self._get_stored_surface(cache_key,
+                                                                icon_info)
+        if surface is not None:
+            return atlas.add(cache_key, surface)
+
+        width, height, surface_format, draw = self._prepare_render(icon_info)
+        draw(atlas.allocate(cache_key, width, height, surface_format))
+        return atlas.get(cache_key)
 
     xo_color = property(_get_xo_color, _set_xo_color)
 
@@ -325,6 +949,8 @@ class Icon(Gtk.Image):
         self._file = None
         self._alpha = 1.0
         self._scale = 1.0
+        self._async_render = False
+        self._surface = None
 
         GObject.GObject.__init__(self, **kwargs)
 
@@ -361,9 +987,27 @@ class Icon(Gtk.Image):
     def _file_changed_cb(self, image, pspec):
         self._buffer.file_name = self.props.file
 
+    def _get_surface(self, sensitive=True):
+        if not self._async_render:
+            return self._buffer.get_surface(sensitive, self)
+
+        surface = self._buffer.get_surface_async(self.__surface_rendered_cb,
+                                                 sensitive, self)
+        if surface is None:
+            # Keep showing the previous icon until the new one is rendered
+            return self._surface
+
+        self._surface = surface
+        return surface
+
+    def __surface_rendered_cb(self, surface):
+        # Nothing new to show if the icon could not be rendered
+        if surface is not None:
+            self.queue_resize()
+
     def do_get_preferred_height(self):
         self._sync_image_properties()
-        surface = self._buffer.get_surface()
+        surface = self._get_surface()
         if surface:
             height = surface.get_height()
         elif self._buffer.height:
@@ -374,7 +1018,7 @@ class Icon(Gtk.Image):
 
     def do_get_preferred_width(self):
         self._sync_image_properties()
-        surface = self._buffer.get_surface()
+        surface = self._get_surface()
         if surface:
             width = surface.get_width()
         elif self._buffer.width:
@@ -386,7 +1030,7 @@ class Icon(Gtk.Image):
     def do_draw(self, cr):
         self._sync_image_properties()
         sensitive = (self.is_sensitive())
-        surface = self._buffer.get_surface(sensitive, self)
+        surface = self._get_surface(sensitive)
         if surface is None:
             return
 
@@ -475,6 +1119,16 @@ class Icon(Gtk.Image):
     scale = GObject.property(
         type=float, setter=set_scale)
 
+    def set_async_render(self, value):
+        self._async_render = value
+
+    def get_async_render(self):
+        return self._async_render
+
+    async_render = GObject.property(
+        type=bool, default=False, getter=get_async_render,
+        setter=set_async_render)
+
 
 class EventIcon(Gtk.EventBox):
     """
@@ -487,6 +1141,8 @@ class EventIcon(Gtk.EventBox):
     def __init__(self, **kwargs):
         self._buffer = _IconBuffer()
         self._alpha = 1.0
+        self._async_render = False
+        self._surface = None
 
         Gtk.EventBox.__init__(self)
         self.set_visible_window(False)
@@ -502,8 +1158,25 @@ class EventIcon(Gtk.EventBox):
         self._palette_invoker.attach(self)
         self.connect('destroy', self.__destroy_cb)
 
+    def _get_surface(self):
+        if not self._async_render:
+            return self._buffer.get_surface()
+
+        surface = self._buffer.get_surface_async(self.__surface_rendered_cb)
+        if surface is None:
+            # Keep showing the previous icon until the new one is rendered
+            return self._surface
+
+        self._surface = surface
+        return surface
+
+    def __surface_rendered_cb(self, surface):
+        # Nothing new to show if the icon could not be rendered
+        if surface is not None:
+            self.queue_resize()
+
     def do_draw(self, cr):
-        surface = self._buffer.get_surface()
+        surface = self._get_surface()
         if surface:
             allocation = self.get_allocation()
 
@@ -517,7 +1190,7 @@ class EventIcon(Gtk.EventBox):
                 cr.paint_with_alpha(self._alpha)
 
     def do_get_preferred_height(self):
-        surface = self._buffer.get_surface()
+        surface = self._get_surface()
         if surface:
             height = surface.get_height()
         elif self._buffer.height:
@@ -527,7 +1200,7 @@ class EventIcon(Gtk.EventBox):
         return (height, height)
 
     def do_get_preferred_width(self):
-        surface = self._buffer.get_surface()
+        surface = self._get_surface()
         if surface:
             width = surface.get_width()
         elif self._buffer.width:
@@ -643,6 +1316,16 @@ class EventIcon(Gtk.EventBox):
     cache = GObject.property(
         type=bool, default=False, getter=get_cache, setter=set_cache)
 
+    def set_async_render(self, value):
+        self._async_render = value
+
+    def get_async_render(self):
+        return self._async_render
+
+    async_render = GObject.property(
+        type=bool, default=False, getter=get_async_render,
+        setter=set_async_render)
+
     def set_badge_name(self, value):
         if self._buffer.badge_name != value:
             self._buffer.badge_name = value
@@ -748,6 +1431,8 @@ class CellRendererIcon(Gtk.CellRenderer):
         'clicked': (GObject.SignalFlags.RUN_FIRST, None, [object]),
     }
 
+    _atlas = _SurfaceAtlas(_IconBuffer._surface_cache)
+
     def __init__(self, tree_view):
         from sugar3.graphics.palette import CellRendererInvoker
 
@@ -759,6 +1444,7 @@ class CellRendererIcon(Gtk.CellRenderer):
         self._prelit_fill_color = None
         self._prelit_stroke_color = None
         self._active_state = False
+        self._use_atlas = False
         self._palette_invoker = CellRendererInvoker()
 
         Gtk.CellRenderer.__init__(self)
@@ -849,6 +1535,15 @@ class CellRendererIcon(Gtk.CellRenderer):
 
     size = GObject.property(type=object, setter=set_size)
 
+    def set_atlas(self, value):
+        self._use_atlas = value
+
+    def get_atlas(self):
+        return self._use_atlas
+
+    atlas = GObject.property(type=bool, default=False, getter=get_atlas,
+                             setter=set_atlas)
+
     def do_get_size(self, widget, cell_area, x_offset=None, y_offset=None,
                     width=None, height=None):
         width = self._buffer.width + self.props.xpad * 2
@@ -948,42 +1643,52 @@ class CellRendererIcon(Gtk.CellRenderer):
             self._buffer.fill_color = fill_color
             self._buffer.stroke_color = stroke_color
 
-        surface = self._buffer.get_surface()
-        if surface is None:
+        if self._use_atlas:
+            slot = self._get_atlas_slot()
+        else:
+            surface = self._buffer.get_surface()
+            slot = None
+            if surface is not None:
+                slot = (surface, 0, 0, surface.get_width(),
+                        surface.get_height())
+        if slot is None:
             return
+        surface, atlas_x, atlas_y, width, height = slot
 
         xoffset, yoffset, width_, height_ = self.do_get_size(widget, cell_area)
 
-        x = cell_area.x + xoffset
-        y = cell_area.y + yoffset
+        x = math.floor(cell_area.x + xoffset)
+        y = math.floor(cell_area.y + yoffset)
 
-        cr.set_source_surface(surface, math.floor(x), math.floor(y))
+        cr.set_source_surface(surface, x - atlas_x, y - atlas_y)
         cr.rectangle(cell_area.x, cell_area.y, cell_area.width,
                      cell_area.height)
         cr.clip()
+        if self._use_atlas:
+            cr.rectangle(x, y, width, height)
+            cr.clip()
         cr.paint()
 
+    def _get_atlas_slot(self):
+        return self._buffer.get_atlas_slot(self._atlas)
+
 
 def get_icon_state(base_name, perc, step=5):
     strength = round(perc / step) * step
-    icon_theme = Gtk.IconTheme.get_default()
 
     while strength <= 100 and strength >= 0:
         icon_name = '%s-%03d' % (base_name, strength)
-        if icon_theme.has_icon(icon_name):
+        if _icon_lookup.has_icon(icon_name):
             return icon_name
 
         strength = strength + step
 
 
 def get_icon_file_name(icon_name):
-    icon_theme = Gtk.IconTheme.get_default()
-    info = icon_theme.lookup_icon(icon_name, Gtk.IconSize.LARGE_TOOLBAR, 0)
+    info = _icon_lookup.lookup(icon_name, Gtk.IconSize.LARGE_TOOLBAR)
     if not info:
         return None
-    filename = info.get_filename()
-    del info
-    return filename
+    return info[0]
 
 
 def get_surface(**kwargs):
@@ -1012,3 +1717,102 @@ def get_surface(**kwargs):
     for key, value in kwargs.items():
         icon.__setattr__(key, value)
     return icon.get_surface()
+
+
+def get_cache_statistics():
+    """Get the statistics of the icon caches.
+
+        Return: a dictionary mapping the name of each cache ('surface',
+        'svg' and 'handle') to a dictionary with its 'size' and
+        'max_size' in bytes and its 'hits', 'misses' and 'evictions'
+        counters.
+
+        """
+    caches = {'surface': _IconBuffer._surface_cache,
+              'svg': _IconBuffer._loader._cache,
+              'handle': _IconBuffer._loader._handle_cache}
+
+    statistics = {}
+    for name, cache in caches.items():
+        statistics[name] = {'size': cache.size,
+                            'max_size': cache.max_size,
+                            'hits': cache.hits,
+                            'misses': cache.misses,
+                            'evictions': cache.evictions}
+    return statistics
+
+
+def prerender_surfaces(specs, idle=False, slice_size=5):
+    """Render icons in bulk and fill the surface cache with them.
+
+        Drawing a toolbar or a tree view for the first time looks up and
+        renders every icon one at a time. Prerendering them beforehand
+        avoids that stall: the theme lookups are resolved in one pass,
+        only once for each icon name and size, and only the surfaces
+        missing from the cache are rendered.
+
+        Keyword arguments:
+        specs            -- list of dictionaries with the keyword arguments
+                            of get_surface() for each icon
+        idle             -- render the icons from an idle callback instead
+                            of right away, default False
+        slice_size       -- number of icons rendered by each idle callback,
+                            default 5
+
+        Return: the id of the idle callback source in idle mode, else None
+
+        """
+    icon_infos = {}
+    buffers = []
+    for spec in specs:
+        icon = _IconBuffer()
+        for key, value in spec.items():
+            icon.__setattr__(key, value)
+
+        lookup_key = (icon.icon_name, icon.file_name, icon.width)
+        if lookup_key not in icon_infos:
+            icon_infos[lookup_key] = icon._get_icon_info()
+        buffers.append((icon, icon_infos[lookup_key]))
+
+    slice_size = max(slice_size, 1)
+
+    def render_slice():
+        for icon, icon_info in buffers[:slice_size]:
+            icon.get_surface(icon_info=icon_info)
+        del buffers[:slice_size]
+        return bool(buffers)
+
+    if idle:
+        return GObject.idle_add(render_slice)
+
+    while render_slice():
+        pass
+    return None
+
+
+def prerender_icon_sizes(specs, scalings=(72, 100), idle=False):
+    """Prerender icons at the standard icon sizes of several scalings.
+
+        Keyword arguments:
+        specs            -- list of dictionaries with the keyword arguments
+                            of get_surface() for each icon, without size
+        scalings         -- SUGAR_SCALING values to render the standard
+                            icon sizes for, default (72, 100)
+        idle             -- render the icons from an idle callback instead
+                            of right away, default False
+
+        Return: the id of the idle callback source in idle mode, else None
+
+        """
+    sizes = set()
+    for scaling in scalings:
+        sizes.update(style.get_icon_sizes(scaling))
+
+    sized_specs = []
+    for size in sorted(sizes):
+        for spec in specs:
+            sized_spec = dict(spec)
+            sized_spec['width'] = sized_spec['height'] = size
+            sized_specs.append(sized_spec)
+
+    return prerender_surfaces(sized_specs, idle)
@@ -116,6 +116,20 @@ MEDIUM_ICON_SIZE = zoom(55 * 1.5)
 LARGE_ICON_SIZE = zoom(55 * 2.0)
 XLARGE_ICON_SIZE = zoom(55 * 2.75)
 
+_ICON_SIZE_UNITS = [55, 55 * 0.5, 55 * 1.5, 55 * 2.0, 55 * 2.75]
+
+
+def get_icon_sizes(scaling=None):
+    """Get the standard, small, medium, large and xlarge icon sizes.
+
+    scaling -- SUGAR_SCALING value to compute them for, default is the
+               current zoom factor
+    """
+    if scaling is None:
+        return [zoom(units) for units in _ICON_SIZE_UNITS]
+
+    return [int(scaling / 100.0 * units) for units in _ICON_SIZE_UNITS]
+
 client = GConf.Client.get_default()
 FONT_SIZE = client.get_float('/desktop/sugar/font/default_size')
 FONT_FACE = client.get_string('/desktop/sugar/font/default_face')
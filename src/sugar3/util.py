@@ -21,6 +21,7 @@ UNSTABLE. We have been adding helpers randomly to this module.
 """
 
 import os
+import sys
 import time
 import hashlib
 import random
@@ -207,6 +208,50 @@ class LRU:
         return self.d.keys()
 
 
+class SizedLRU(LRU):
+    """
+    LRU queue limited by the total size of its values instead of their
+    number. The size of a value is computed by get_size when it is added.
+
+    Hits and misses are counted by get(), evictions when the size limit
+    is reached, so that the limit can be tuned.
+    """
+
+    def __init__(self, max_size, get_size=len):
+        self.max_size = max_size
+        self.get_size = get_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sizes = {}
+        LRU.__init__(self, sys.maxint)
+
+    def __setitem__(self, obj, val):
+        LRU.__setitem__(self, obj, val)
+
+        size = self.get_size(val)
+        self._sizes[obj] = size
+        self.size += size
+
+        # Always keep the last value, even if it is bigger than the limit
+        while self.size > self.max_size and self.first is not self.last:
+            del self[self.first.me[0]]
+            self.evictions += 1
+
+    def __delitem__(self, obj):
+        LRU.__delitem__(self, obj)
+        self.size -= self._sizes.pop(obj)
+
+    def get(self, obj, default=None):
+        if obj in self.d:
+            self.hits += 1
+            return self[obj]
+
+        self.misses += 1
+        return default
+
+
 units = [['%d year', '%d years', 356 * 24 * 60 * 60],
          ['%d month', '%d months', 30 * 24 * 60 * 60],
          ['%d week', '%d weeks', 7 * 24 * 60 * 60],
@@ -0,0 +1,253 @@
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Benchmark the sugar3.graphics.icon rendering path.
+
+Icons of a theme are rendered with random XO colors, badges and sizes,
+and for each benchmark the renders per second, the surface cache hit
+rate, the peak RSS and the p50/p99 draw latencies are reported. Each
+benchmark is run in a new process, so that its peak RSS and cache hit
+rate don't depend on the benchmarks run before.
+
+Everything is drawn on an offscreen cairo surface so it runs without a
+display, the benchmarks which need one (theme lookups, badges and the
+widgets) are skipped when there is none. The icon disk cache of a
+separate 'iconbenchmark' profile is used, and emptied at start.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import resource
+import subprocess
+from optparse import OptionParser
+
+os.environ.setdefault('SUGAR_PROFILE', 'iconbenchmark')
+
+from gi.repository import Gtk
+from gi.repository import Gdk
+import cairo
+
+from sugar3 import env
+from sugar3.graphics import style
+from sugar3.graphics import icon
+from sugar3.graphics.icon import Icon
+from sugar3.graphics.icon import EventIcon
+from sugar3.graphics.icon import CellRendererIcon
+from sugar3.graphics.xocolor import XoColor
+
+_BADGES = ['emblem-favorite', 'emblem-locked', 'emblem-notification']
+
+
+def _find_icons(theme_dir):
+    icons = {}
+    for root, dirs_, files in os.walk(theme_dir):
+        for file_name in files:
+            if file_name.endswith('.svg'):
+                icons[file_name[:-4]] = os.path.join(root, file_name)
+    return icons
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+class Benchmark(object):
+
+    def __init__(self, name, icons, iterations, use_theme):
+        self.name = name
+        self._icons = icons
+        self._names = sorted(icons.keys())
+        self._iterations = iterations
+        self._use_theme = use_theme
+
+    def random_spec(self):
+        name = random.choice(self._names)
+        if self._use_theme:
+            spec = {'icon_name': name}
+            if random.random() < 0.2:
+                spec['badge_name'] = random.choice(_BADGES)
+        else:
+            spec = {'file_name': self._icons[name]}
+
+        size = random.choice(style.get_icon_sizes())
+        spec['width'] = spec['height'] = size
+        spec['xo_color'] = XoColor()
+        return spec
+
+    def draw(self, context, spec):
+        raise NotImplementedError
+
+    def run(self):
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                     style.XLARGE_ICON_SIZE * 2,
+                                     style.XLARGE_ICON_SIZE * 2)
+        context = cairo.Context(surface)
+
+        statistics = icon.get_cache_statistics()['surface']
+        hits, misses = statistics['hits'], statistics['misses']
+
+        latencies = []
+        start = time.time()
+        for i_ in range(self._iterations):
+            spec = self.random_spec()
+            draw_start = time.time()
+            context.save()
+            self.draw(context, spec)
+            context.restore()
+            latencies.append(time.time() - draw_start)
+        elapsed = time.time() - start
+
+        statistics = icon.get_cache_statistics()['surface']
+        hits = statistics['hits'] - hits
+        misses = statistics['misses'] - misses
+        lookups = hits + misses
+
+        return {'renders': self._iterations / elapsed,
+                'hit_rate': float(hits) / lookups if lookups else 0.0,
+                'peak_rss': resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss,
+                'p50': _percentile(latencies, 50) * 1000,
+                'p99': _percentile(latencies, 99) * 1000}
+
+
+class SurfaceBenchmark(Benchmark):
+
+    def draw(self, context, spec):
+        surface = icon.get_surface(**spec)
+        context.set_source_surface(surface, 0, 0)
+        context.paint()
+
+
+class IconBenchmark(Benchmark):
+
+    def __init__(self, name, icons, iterations, use_theme):
+        Benchmark.__init__(self, name, icons, iterations, use_theme)
+        self._icon = Icon()
+
+    def draw(self, context, spec):
+        if 'icon_name' in spec:
+            self._icon.props.icon_name = spec['icon_name']
+        else:
+            self._icon.props.file = spec['file_name']
+        self._icon.props.pixel_size = spec['width']
+        self._icon.props.badge_name = spec.get('badge_name')
+        self._icon.props.xo_color = spec['xo_color']
+        self._icon.do_draw(context)
+
+
+class EventIconBenchmark(Benchmark):
+
+    def __init__(self, name, icons, iterations, use_theme):
+        Benchmark.__init__(self, name, icons, iterations, use_theme)
+        self._icon = EventIcon()
+
+    def draw(self, context, spec):
+        self._icon.props.icon_name = spec.get('icon_name')
+        self._icon.props.file_name = spec.get('file_name')
+        self._icon.props.pixel_size = spec['width']
+        self._icon.props.badge_name = spec.get('badge_name')
+        self._icon.props.xo_color = spec['xo_color']
+        self._icon.do_draw(context)
+
+
+class CellRendererIconBenchmark(Benchmark):
+
+    def __init__(self, name, icons, iterations, use_theme):
+        Benchmark.__init__(self, name, icons, iterations, use_theme)
+        self._tree_view = Gtk.TreeView()
+        self._cell = CellRendererIcon(self._tree_view)
+
+    def draw(self, context, spec):
+        if 'icon_name' in spec:
+            self._cell.props.icon_name = spec['icon_name']
+        else:
+            self._cell.props.file_name = spec['file_name']
+        self._cell.props.size = spec['width']
+        self._cell.props.xo_color = spec['xo_color']
+
+        area = Gdk.Rectangle()
+        area.width = area.height = spec['width']
+        self._cell.do_render(context, self._tree_view, area, area, 0)
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-n', '--iterations', type='int', default=1000,
+                      help='number of icons drawn by each benchmark')
+    parser.add_option('-t', '--theme-dir', default='/usr/share/icons/sugar',
+                      help='directory of the icons to render')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='seed of the random icons, sizes and colors')
+    parser.add_option('-b', '--benchmark',
+                      help='run only the benchmark of this name, in this '
+                      'process')
+    options, args_ = parser.parse_args()
+
+    random.seed(options.seed)
+    if options.benchmark is None:
+        shutil.rmtree(env.get_profile_path('icon-cache'), ignore_errors=True)
+
+    icons = _find_icons(options.theme_dir)
+    if not icons:
+        print 'ERROR - No icon found in %s.' % options.theme_dir
+        sys.exit(1)
+
+    has_display = Gdk.Screen.get_default() is not None
+
+    benchmarks = [SurfaceBenchmark('get_surface (files)', icons,
+                                   options.iterations, False)]
+    if has_display:
+        benchmarks += [
+            SurfaceBenchmark('get_surface (theme)', icons,
+                             options.iterations, True),
+            IconBenchmark('Icon', icons, options.iterations, True),
+            EventIconBenchmark('EventIcon', icons, options.iterations, True),
+            CellRendererIconBenchmark('CellRendererIcon', icons,
+                                      options.iterations, True)]
+    elif options.benchmark is None:
+        print 'No display, skipping the theme and widget benchmarks.\n'
+
+    if options.benchmark is not None:
+        for benchmark in benchmarks:
+            if benchmark.name == options.benchmark:
+                result = benchmark.run()
+                print '%-22s %10.1f %8.1f%% %9d KB %6.2f ms %6.2f ms' % (
+                    benchmark.name, result['renders'],
+                    result['hit_rate'] * 100, result['peak_rss'],
+                    result['p50'], result['p99'])
+                return
+        print 'ERROR - No benchmark named %r.' % options.benchmark
+        sys.exit(1)
+
+    print '%-22s %10s %9s %12s %9s %9s' % (
+        'benchmark', 'renders/s', 'hit rate', 'peak RSS', 'p50', 'p99')
+    sys.stdout.flush()
+    for benchmark in benchmarks:
+        # ru_maxrss is the peak of the whole process, so each benchmark
+        # runs in its own
+        subprocess.call([sys.executable, sys.argv[0], '--benchmark',
+                         benchmark.name] + sys.argv[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the
+# Free Software Foundation, Inc., 59 Temple Place - Suite 330,
+# Boston, MA 02111-1307, USA.
+
+"""
+Benchmark sugar3.datastore.datastore with the in-process SQLite
+datastore of sugar3.datastore.localstore, so no DataStore service or
+session bus is needed.
+
+The datastore is filled up to each of the sizes given, then the
+operations per second and the p50/p99 latencies of writes and of
+typical Journal queries are reported. The idle callbacks queued by the
+datastore signals are dispatched between the operations, as the main
+loop of an activity would.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from gi.repository import GLib
+
+from sugar3.datastore import datastore
+from sugar3.datastore.localstore import LocalDataStore
+
+_WORDS = ['drawing', 'story', 'music', 'turtle', 'paint', 'write', 'chat',
+          'maze', 'memory', 'physics', 'record', 'measure', 'calculate',
+          'read', 'browse', 'terminal', 'pippy', 'etoys', 'scratch', 'speak']
+
+_ACTIVITIES = ['org.laptop.%s' % word.capitalize() for word in _WORDS]
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def _run_pending():
+    context = GLib.MainContext.default()
+    while context.pending():
+        context.iteration(False)
+
+
+def _create_entry(preview):
+    ds_object = datastore.create()
+    ds_object.metadata['title'] = ' '.join(random.sample(_WORDS, 3))
+    ds_object.metadata['description'] = ' '.join(random.sample(_WORDS, 8))
+    ds_object.metadata['tags'] = ' '.join(random.sample(_WORDS, 2))
+    ds_object.metadata['activity'] = random.choice(_ACTIVITIES)
+    ds_object.metadata['keep'] = random.choice(['0', '1'])
+    ds_object.metadata['icon-color'] = '#FF0000,#00FF00'
+    ds_object.metadata['preview'] = preview
+    datastore.write(ds_object)
+    ds_object.destroy()
+    return ds_object.object_id
+
+
+class Benchmark(object):
+    """Time an operation, setup is called before each of them but is not
+    timed."""
+
+    def __init__(self, name, operation, setup=None):
+        self.name = name
+        self._operation = operation
+        self._setup = setup
+
+    def run(self, iterations):
+        latencies = []
+        for i_ in range(iterations):
+            if self._setup is not None:
+                self._setup()
+            _run_pending()
+            operation_start = time.time()
+            self._operation()
+            latencies.append(time.time() - operation_start)
+        _run_pending()
+        elapsed = sum(latencies)
+
+        return {'operations': iterations / elapsed,
+                'p50': _percentile(latencies, 50) * 1000,
+                'p99': _percentile(latencies, 99) * 1000}
+
+
+def main():
+    parser = OptionParser(usage='usage: %prog [options]')
+    parser.add_option('-e', '--entries', default='10000,100000',
+                      help='comma separated sizes of the datastore')
+    parser.add_option('-n', '--iterations', type='int', default=200,
+                      help='number of operations of each benchmark')
+    parser.add_option('-p', '--preview-size', type='int', default=1024,
+                      help='size in bytes of the preview of the entries')
+    parser.add_option('-s', '--seed', type='int', default=0,
+                      help='seed of the random metadata')
+    options, args_ = parser.parse_args()
+
+    random.seed(options.seed)
+    sizes = sorted([int(size) for size in options.entries.split(',')])
+    preview = os.urandom(options.preview_size)
+
+    root_path = tempfile.mkdtemp(prefix='datastorebenchmark')
+    datastore.set_backend(LocalDataStore(root_path))
+    object_ids = []
+
+    def create():
+        object_ids.append(_create_entry(preview))
+
+    def update():
+        ds_object = datastore.get(random.choice(object_ids))
+        ds_object.metadata['title'] = ' '.join(random.sample(_WORDS, 3))
+        datastore.write(ds_object)
+        ds_object.destroy()
+
+    def find_fulltext():
+        datastore.find({'query': random.choice(_WORDS) + '*'},
+                       sorting=['-timestamp'], limit=50,
+                       with_preview=False)
+
+    def find_activity():
+        datastore.find({'activity': random.choice(_ACTIVITIES)},
+                       sorting=['-timestamp'], limit=50,
+                       with_preview=False)
+
+    def find_page():
+        datastore.find({}, sorting=['+title'], limit=50,
+                       offset=random.randint(0, len(object_ids) - 50))
+
+    def find_unique_values():
+        datastore.get_unique_values('activity')
+
+    def update_activity():
+        # Invalidates the unique values if it was the last one of its value
+        ds_object = datastore.get(random.choice(object_ids))
+        ds_object.metadata['activity'] = random.choice(_ACTIVITIES)
+        datastore.write(ds_object)
+        ds_object.destroy()
+
+    def clear_unique_values():
+        datastore._unique_values.clear()
+
+    benchmarks = [Benchmark('create', create),
+                  Benchmark('update', update),
+                  Benchmark('find (full-text)', find_fulltext),
+                  Benchmark('find (activity)', find_activity),
+                  Benchmark('find (sorted page)', find_page),
+                  Benchmark('get_unique_values', find_unique_values),
+                  Benchmark('get_unique_values (updated)',
+                            find_unique_values, update_activity),
+                  Benchmark('get_unique_values (cold)', find_unique_values,
+                            clear_unique_values)]
+
+    try:
+        for size in sizes:
+            start = time.time()
+            while len(object_ids) < size:
+                create()
+                _run_pending()
+            sys.stderr.write('Filled the datastore up to %d entries in '
+                             '%.1f s.\n' % (size, time.time() - start))
+
+            print '%d entries' % size
+            print '%-30s %10s %9s %9s' % ('benchmark', 'ops/s', 'p50', 'p99')
+            for benchmark in benchmarks:
+                result = benchmark.run(options.iterations)
+                print '%-30s %10.1f %6.2f ms %6.2f ms' % (
+                    benchmark.name, result['operations'], result['p50'],
+                    result['p99'])
+            print
+    finally:
+        shutil.rmtree(root_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,11 +18,17 @@
 import unittest
 
 import test_mime
+import test_bundle
+import test_bundlebuilder
+import test_datastore
 
 runner = unittest.TextTestRunner()
 loader = unittest.TestLoader()
 
 suite = unittest.TestSuite()
 suite.addTest(loader.loadTestsFromModule(test_mime))
+suite.addTest(loader.loadTestsFromModule(test_bundle))
+suite.addTest(loader.loadTestsFromModule(test_bundlebuilder))
+suite.addTest(loader.loadTestsFromModule(test_datastore))
 
 runner.run(suite)
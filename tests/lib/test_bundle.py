@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from sugar3.bundle.bundle import Bundle
+from sugar3.bundle.bundle import MalformedBundleException
+from sugar3.bundle.bundle import ZipExtractException
+
+
+class _TestBundle(Bundle):
+    _zipped_extension = '.xo'
+    _unzipped_extension = '.activity'
+
+
+def _write_zip(path, members):
+    """Write a zip file, members is a list of (name, data) for the files
+    and directories, and of (name, target, True) for the symbolic links."""
+    zip_file = zipfile.ZipFile(path, 'w')
+    for member in members:
+        info = zipfile.ZipInfo(member[0])
+        if len(member) == 3:
+            info.external_attr = (stat.S_IFLNK | 0777) << 16
+        elif member[0].endswith('/'):
+            info.external_attr = (stat.S_IFDIR | 0755) << 16
+        else:
+            info.external_attr = (stat.S_IFREG | 0644) << 16
+        zip_file.writestr(info, member[1])
+    zip_file.close()
+
+
+class TestBundleExtraction(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._install_dir = os.path.join(self._temp_dir, 'activities')
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _get_bundle(self, members):
+        path = os.path.join(self._temp_dir, 'Test.xo')
+        _write_zip(path, members)
+        return _TestBundle(path)
+
+    def _install(self, members):
+        bundle = self._get_bundle(members)
+        bundle._unzip(self._install_dir)
+
+    def _assert_not_extracted(self, members):
+        self.assertRaises(MalformedBundleException, self._install, members)
+        # Nothing is written, not even the temporary directory
+        self.assertFalse(os.path.exists(self._install_dir))
+        self.assertFalse(os.path.exists(os.path.join(self._temp_dir,
+                                                     'evil')))
+
+    def test_extract(self):
+        self._install([('Test.activity/', ''),
+                       ('Test.activity/activity/activity.info', 'info'),
+                       ('Test.activity/data/a', 'a'),
+                       ('Test.activity/data/link', 'a', True)])
+
+        path = os.path.join(self._install_dir, 'Test.activity')
+        self.assertEqual(os.listdir(self._install_dir), ['Test.activity'])
+        self.assertEqual(open(os.path.join(path, 'data', 'a')).read(), 'a')
+        self.assertEqual(os.readlink(os.path.join(path, 'data', 'link')),
+                         'a')
+
+    def test_traversal(self):
+        self._assert_not_extracted([('Test.activity/a', 'a'),
+                                    ('Test.activity/../evil', 'evil')])
+        self._assert_not_extracted([('Test.activity/a', 'a'),
+                                    ('Test.activity/b/../../evil', 'evil')])
+        self._assert_not_extracted([('Test.activity/a', 'a'),
+                                    ('Test.activity//evil', 'evil')])
+        self.assertRaises(MalformedBundleException, self._install,
+                          [('Test.activity/a', 'a'), ('/evil', 'evil')])
+
+    def test_escaping_links(self):
+        self._assert_not_extracted([('Test.activity/a', '../evil', True)])
+        self._assert_not_extracted([('Test.activity/b/a', 'c/../../../evil',
+                                     True)])
+        self._assert_not_extracted([('Test.activity/a', '/etc/passwd',
+                                     True)])
+
+        self._install([('Test.activity/b/a', '../c', True),
+                       ('Test.activity/c', 'c')])
+
+    def _assert_not_installed(self, members):
+        self.assertRaises(MalformedBundleException, self._install, members)
+        self.assertEqual(os.listdir(self._install_dir), [])
+        self.assertFalse(os.path.exists(os.path.join(self._temp_dir,
+                                                     'evil')))
+
+    def test_links_through_links(self):
+        # Each target stays inside by name, but not once resolved
+        self._assert_not_installed([('Test.activity/d/b', '..', True),
+                                    ('Test.activity/a', 'd/b/../evil',
+                                     True)])
+        self._assert_not_installed([('Test.activity/d/e', '..', True),
+                                    ('Test.activity/f/g', '../d/e/..',
+                                     True)])
+
+    def test_members_inside_links(self):
+        self._assert_not_extracted([('Test.activity/a', 'b', True),
+                                    ('Test.activity/b/', ''),
+                                    ('Test.activity/a/evil', 'evil')])
+        self._assert_not_extracted([('Test.activity/a', 'b', True),
+                                    ('Test.activity/a/c/d', 'd')])
+        self._assert_not_extracted([('Test.activity/c', 'c'),
+                                    ('Test.activity/a', 'c', True),
+                                    ('Test.activity/a', 'a')])
+
+    def test_directory_clashing_with_file(self):
+        self._assert_not_extracted([('Test.activity/a', 'a'),
+                                    ('Test.activity/a/', '')])
+        self._assert_not_extracted([('Test.activity/a', 'a'),
+                                    ('Test.activity/a/b', 'b')])
+
+    def test_failed_extraction_keeps_previous_install(self):
+        self._install([('Test.activity/a', 'old'),
+                       ('Test.activity/b', 'old')])
+
+        bundle_path = os.path.join(self._temp_dir, 'Test.xo')
+        _write_zip(bundle_path, [('Test.activity/a', 'new'),
+                                 ('Test.activity/b', 'new')])
+        # Corrupt the data of the last member, its CRC does not match
+        with open(bundle_path, 'r+b') as bundle_file:
+            data = bundle_file.read()
+            bundle_file.seek(data.rindex('new'))
+            bundle_file.write('bad')
+
+        bundle = _TestBundle(bundle_path)
+        self.assertRaises(ZipExtractException, bundle._unzip,
+                          self._install_dir)
+
+        path = os.path.join(self._install_dir, 'Test.activity')
+        self.assertEqual(os.listdir(self._install_dir), ['Test.activity'])
+        self.assertEqual(open(os.path.join(path, 'a')).read(), 'old')
+        self.assertEqual(open(os.path.join(path, 'b')).read(), 'old')
+
+    def test_reinstall(self):
+        self._install([('Test.activity/a', 'old'),
+                       ('Test.activity/b', 'old')])
+        self._install([('Test.activity/a', 'new')])
+
+        path = os.path.join(self._install_dir, 'Test.activity')
+        self.assertEqual(os.listdir(self._install_dir), ['Test.activity'])
+        self.assertEqual(os.listdir(path), ['a'])
+        self.assertEqual(open(os.path.join(path, 'a')).read(), 'new')
+
+
+class TestBundleFiles(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._members = [('Test.activity/activity/activity.info', 'info'),
+                         ('Test.activity/data/', ''),
+                         ('Test.activity/icons/a/b.svg', 'svg')]
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+
+    def _get_zip_bundle(self):
+        path = os.path.join(self._temp_dir, 'Test.xo')
+        _write_zip(path, self._members)
+        return _TestBundle(path)
+
+    def _get_dir_bundle(self):
+        path = os.path.join(self._temp_dir, 'Test.activity')
+        for member in self._members:
+            member_path = os.path.join(self._temp_dir, member[0])
+            if member[0].endswith('/'):
+                os.makedirs(member_path)
+                continue
+            if not os.path.isdir(os.path.dirname(member_path)):
+                os.makedirs(os.path.dirname(member_path))
+            with open(member_path, 'w') as member_file:
+                member_file.write(member[1])
+        return _TestBundle(path)
+
+    def _check_bundle(self, bundle):
+        self.assertTrue(bundle.is_file('activity/activity.info'))
+        self.assertTrue(bundle.is_file('./icons/a/b.svg'))
+        self.assertTrue(bundle.is_file('icons//a/../a/b.svg'))
+        self.assertFalse(bundle.is_file('icons/a'))
+        self.assertFalse(bundle.is_file('data'))
+        self.assertFalse(bundle.is_file('missing'))
+
+        self.assertTrue(bundle.is_dir(''))
+        self.assertTrue(bundle.is_dir('.'))
+        self.assertTrue(bundle.is_dir('data'))
+        self.assertTrue(bundle.is_dir('data/'))
+        # Zip files don't need entries for the parent directories
+        self.assertTrue(bundle.is_dir('icons'))
+        self.assertTrue(bundle.is_dir('icons/a'))
+        self.assertFalse(bundle.is_dir('icons/a/b.svg'))
+        self.assertFalse(bundle.is_dir('missing'))
+
+        info_file = bundle.open_file('activity/activity.info')
+        try:
+            self.assertEqual(info_file.read(), 'info')
+        finally:
+            info_file.close()
+        self.assertEqual(bundle.open_file('missing'), None)
+        self.assertEqual(bundle.get_file('icons/a/b.svg').read(), 'svg')
+
+    def test_zip_bundle(self):
+        self._check_bundle(self._get_zip_bundle())
+
+    def test_dir_bundle(self):
+        self._check_bundle(self._get_dir_bundle())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from sugar3.activity.bundlebuilder import Config
+from sugar3.activity.bundlebuilder import Builder
+from sugar3.activity.bundlebuilder import XOPackager
+
+_ACTIVITY_INFO = """[Activity]
+name = Test
+bundle_id = org.sugarlabs.Test
+exec = sugar-activity test.TestActivity
+icon = activity-test
+activity_version = 1
+"""
+
+
+class TestXOPackager(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._source_dir = os.path.join(self._temp_dir, 'Test.activity')
+        self._dist_dir = os.path.join(self._temp_dir, 'dist')
+
+        self._write_file('activity/activity.info', _ACTIVITY_INFO)
+        self._write_file('test.py', 'print "test"\n' * 100)
+        self._write_file('data/b.txt', 'b' * 1000)
+        self._write_file('data/a.txt', 'a' * 1000)
+        os.chmod(os.path.join(self._source_dir, 'test.py'), 0700)
+
+        self._old_epoch = os.environ.pop('SOURCE_DATE_EPOCH', None)
+
+    def tearDown(self):
+        shutil.rmtree(self._temp_dir)
+        if self._old_epoch is not None:
+            os.environ['SOURCE_DATE_EPOCH'] = self._old_epoch
+
+    def _write_file(self, name, data):
+        path = os.path.join(self._source_dir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def _touch_file(self, name):
+        path = os.path.join(self._source_dir, name)
+        mtime = time.time() + 10
+        os.utime(path, (mtime, mtime))
+
+    def _package(self, processes=1):
+        config = Config(self._source_dir, self._dist_dir)
+        packager = XOPackager(Builder(config), processes)
+        packager.package()
+        with open(packager.package_path, 'rb') as package_file:
+            return package_file.read()
+
+    def _remove_cache(self):
+        for name in os.listdir(self._dist_dir):
+            if name.endswith('.cache'):
+                os.remove(os.path.join(self._dist_dir, name))
+
+    def test_package(self):
+        package_path = os.path.join(self._dist_dir, 'Test-1.xo')
+        self._package()
+
+        bundle_zip = zipfile.ZipFile(package_path)
+        self.assertEqual(bundle_zip.testzip(), None)
+        self.assertEqual(bundle_zip.namelist(),
+                         ['Test.activity/activity/activity.info',
+                          'Test.activity/data/a.txt',
+                          'Test.activity/data/b.txt',
+                          'Test.activity/test.py'])
+        self.assertEqual(bundle_zip.read('Test.activity/data/a.txt'),
+                         'a' * 1000)
+        for info in bundle_zip.infolist():
+            self.assertEqual(info.date_time, (1980, 1, 1, 0, 0, 0))
+        mode = bundle_zip.getinfo('Test.activity/test.py').external_attr
+        self.assertEqual(mode >> 16 & 0777, 0755)
+        mode = bundle_zip.getinfo('Test.activity/data/a.txt').external_attr
+        self.assertEqual(mode >> 16 & 0777, 0644)
+        bundle_zip.close()
+
+    def test_rebuild_identical(self):
+        first = self._package()
+
+        # Reusing the compressed members of the previous bundle
+        self.assertEqual(self._package(), first)
+
+        # Compressing again the files whose mtime changed only
+        self._touch_file('data/a.txt')
+        self.assertEqual(self._package(), first)
+
+        # Compressing everything, in several processes
+        self._remove_cache()
+        self._touch_file('test.py')
+        self.assertEqual(self._package(processes=2), first)
+
+    def test_rebuild_changed(self):
+        first = self._package()
+
+        self._write_file('data/a.txt', 'c' * 1000)
+        self._touch_file('data/a.txt')
+        second = self._package()
+        self.assertNotEqual(second, first)
+
+        package_path = os.path.join(self._dist_dir, 'Test-1.xo')
+        bundle_zip = zipfile.ZipFile(package_path)
+        self.assertEqual(bundle_zip.testzip(), None)
+        self.assertEqual(bundle_zip.read('Test.activity/data/a.txt'),
+                         'c' * 1000)
+        bundle_zip.close()
+
+        self._remove_cache()
+        self.assertEqual(self._package(), second)
+
+    def test_source_date_epoch(self):
+        first = self._package()
+
+        os.environ['SOURCE_DATE_EPOCH'] = '1000000000'
+        try:
+            second = self._package()
+        finally:
+            del os.environ['SOURCE_DATE_EPOCH']
+        self.assertNotEqual(second, first)
+
+        package_path = os.path.join(self._dist_dir, 'Test-1.xo')
+        bundle_zip = zipfile.ZipFile(package_path)
+        for info in bundle_zip.infolist():
+            self.assertEqual(info.date_time, (2001, 9, 9, 1, 46, 40))
+        bundle_zip.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
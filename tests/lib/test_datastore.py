@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2012, One Laptop Per Child
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sugar3.datastore import datastore
+from sugar3.datastore.localstore import LocalDataStore
+
+
+class _RecordingDataStore(LocalDataStore):
+    """Record the file paths given to update()."""
+
+    def __init__(self, root_path):
+        LocalDataStore.__init__(self, root_path)
+        self.updated_files = []
+
+    def update(self, uid, properties, file_path, transfer_ownership,
+               **kwargs):
+        self.updated_files.append(file_path)
+        return LocalDataStore.update(self, uid, properties, file_path,
+                                     transfer_ownership, **kwargs)
+
+
+class TestWrite(unittest.TestCase):
+
+    def setUp(self):
+        self._temp_dir = tempfile.mkdtemp()
+        self._store = _RecordingDataStore(os.path.join(self._temp_dir,
+                                                       'datastore'))
+        datastore.set_backend(self._store)
+
+        self._ds_object = datastore.create()
+        self._ds_object.metadata['title'] = 'Test'
+        datastore.write(self._ds_object)
+
+    def tearDown(self):
+        self._ds_object.destroy()
+        shutil.rmtree(self._temp_dir)
+
+    def _write_file(self, data):
+        file_path = os.path.join(self._temp_dir, 'instance')
+        with open(file_path, 'w') as f:
+            f.write(data)
+        return file_path
+
+    def _read_entry_file(self, object_id):
+        file_path = self._store.get_filename(object_id)
+        try:
+            with open(file_path) as f:
+                return f.read()
+        finally:
+            os.remove(file_path)
+
+    def _write(self, ds_object, asynchronous, **kwargs):
+        if not asynchronous:
+            datastore.write(ds_object, **kwargs)
+            return
+
+        errors = []
+        datastore.write(ds_object, reply_handler=lambda *args: None,
+                        error_handler=errors.append, **kwargs)
+        if errors:
+            raise errors[0]
+
+    def _check_save_then_save_metadata(self, asynchronous):
+        ds_object = self._ds_object
+        object_id = ds_object.object_id
+
+        # Activity.save()
+        ds_object.file_path = self._write_file('data')
+        self._write(ds_object, asynchronous, transfer_ownership=True)
+        self.assertEqual(ds_object.get_file_path(fetch=False), None)
+
+        # Activity.save_metadata(), after the title was edited
+        ds_object.metadata['title'] = 'Renamed'
+        self._write(ds_object, asynchronous)
+        ds_object.metadata['description'] = 'Described'
+        self._write(ds_object, asynchronous)
+
+        self.assertEqual(self._store.updated_files[-2:], ['', ''])
+        properties = self._store.get_properties(object_id)
+        self.assertEqual(properties['title'], 'Renamed')
+        self.assertEqual(properties['description'], 'Described')
+        self.assertEqual(self._read_entry_file(object_id), 'data')
+
+    def test_save_then_save_metadata(self):
+        self._check_save_then_save_metadata(asynchronous=False)
+
+    def test_save_then_save_metadata_async(self):
+        self._check_save_then_save_metadata(asynchronous=True)
+
+    def test_resumed_metadata_write(self):
+        self._ds_object.file_path = self._write_file('data')
+        datastore.write(self._ds_object, transfer_ownership=True)
+
+        ds_object = datastore.get(self._ds_object.object_id)
+        try:
+            # Activity.read_file() of the entry resumed
+            file_path = ds_object.file_path
+            with open(file_path) as f:
+                self.assertEqual(f.read(), 'data')
+
+            ds_object.metadata['title'] = 'Renamed'
+            datastore.write(ds_object)
+            self.assertEqual(self._store.updated_files[-1], '')
+            self.assertEqual(ds_object.file_path, file_path)
+
+            # Activity.save() of new data
+            ds_object.file_path = self._write_file('new data')
+            datastore.write(ds_object, transfer_ownership=True)
+            self.assertNotEqual(self._store.updated_files[-1], '')
+            self.assertFalse(os.path.exists(file_path))
+        finally:
+            ds_object.destroy()
+
+        self.assertEqual(self._read_entry_file(self._ds_object.object_id),
+                         'new data')
+
+    def test_failed_write_keeps_file(self):
+        ds_object = self._ds_object
+        object_id = ds_object.object_id
+        file_path = self._write_file('data')
+        ds_object.file_path = file_path
+
+        self._store.delete(object_id)
+        self.assertRaises(Exception, datastore.write, ds_object,
+                          transfer_ownership=True)
+        self.assertEqual(ds_object.get_file_path(fetch=False), file_path)
+        self.assertTrue(os.path.exists(file_path))
+
+        # Written with the next write of a new entry
+        ds_object.object_id = None
+        datastore.write(ds_object, transfer_ownership=True)
+        self.assertEqual(self._read_entry_file(ds_object.object_id), 'data')
+
+
+if __name__ == '__main__':
+    unittest.main()